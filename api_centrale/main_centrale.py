@@ -5,11 +5,17 @@ import logging
 import requests
 from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import fitz  # PyMuPDF
 import s3fs
 from PyPDF2 import PdfReader, PdfWriter
 from io import BytesIO
+from observability import PAYLOAD_SIZE, setup_observability, stage_timer, trace_headers
+from resilience import CircuitOpenError, Dependency, urls_from_env
+from prefetch import PREFETCH_WATCHLIST, PrefetchScheduler, select_bilan
+from singleflight import SingleFlight, build_backend, flight_key
+from profiler import setup_profiler
+from prometheus_client import Counter
 
 # Charger .env
 load_dotenv()
@@ -17,9 +23,10 @@ load_dotenv()
 # INPI config (à définir dans .env)
 INPI_USERNAME = os.getenv("INPI_USERNAME")
 INPI_PASSWORD = os.getenv("INPI_PASSWORD")
-INPI_LOGIN_URL = "https://registre-national-entreprises.inpi.fr/api/sso/login"
-INPI_ATTACHMENTS_URL = "https://registre-national-entreprises.inpi.fr/api/companies/{siren}/attachments"
-INPI_DOWNLOAD_URL = "https://registre-national-entreprises.inpi.fr/api/bilans/{identifier}/download"
+INPI_BASE_URL = os.getenv("INPI_BASE_URL", "https://registre-national-entreprises.inpi.fr/api").rstrip("/")
+INPI_LOGIN_URL = f"{INPI_BASE_URL}/sso/login"
+INPI_ATTACHMENTS_URL = INPI_BASE_URL + "/companies/{siren}/attachments"
+INPI_DOWNLOAD_URL = INPI_BASE_URL + "/bilans/{identifier}/download"
 
 # S3 via s3fs (variables d'environnement requises)
 AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET")
@@ -28,6 +35,9 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
 AWS_S3_ENDPOINT = os.getenv("AWS_S3_ENDPOINT")  # ex: "minio.lab.sspcloud.fr"
+# Réutilisation des extractions déjà stockées sur S3 ({siren}_{year}.json) ;
+# toujours active avec le préchargement, dont c'est le seul débouché
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "0") == "1" or bool(PREFETCH_WATCHLIST)
 
 # Vérifications
 if not INPI_USERNAME or not INPI_PASSWORD:
@@ -43,10 +53,25 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc"
 )
+setup_observability(app)
+setup_profiler(app)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Dépendances appelées avec hedging, disjoncteur et nouvelles tentatives.
+# Plusieurs répliques peuvent être listées (séparées par des virgules).
+selector_dependency = Dependency("selector", urls_from_env("LEGACY_SELECTOR_URLS", "LEGACY_SELECTOR_URL"))
+marker_dependency = Dependency("marker", urls_from_env("MARKER_API_URLS", "MARKER_API_URL"))
+
+# Identifiants de client transmis à l'API Marker puis au proxy LLM (budgets de tokens distincts
+# pour les extractions interactives et le préchargement, cf. RATE_LIMIT_CLIENT_TPM)
+CLIENT_ID_HEADER = "x-client-id"
+LLM_CLIENT_ID = os.getenv("LLM_CLIENT_ID", "api-centrale")
+PREFETCH_LLM_CLIENT_ID = os.getenv("PREFETCH_LLM_CLIENT_ID", "prefetch")
+
+RESULT_CACHE_REQUESTS = Counter("result_cache_requests_total", "Consultations du cache S3 des extractions", ["result"])
+
 # Modèles de réponse
 class ExtractionResponse(BaseModel):
     siren: str
@@ -108,35 +133,52 @@ def upload_to_s3(fs: s3fs.S3FileSystem, filename: str, content: bytes):
 
 # Download PDF INPI
 
-def fetch_pdf_inpi(siren: str, year: str) -> bytes:
-    token = get_inpi_token()
+def list_bilans(token: str, siren: str) -> List[Dict[str, Any]]:
     url = INPI_ATTACHMENTS_URL.format(siren=siren)
-    resp = requests.get(url, auth=BearerAuth(token), timeout=30)
+    with stage_timer("inpi_attachments"):
+        resp = requests.get(url, auth=BearerAuth(token), timeout=30)
     if resp.status_code != 200:
         logger.error("INPI attachments error %s: %s", resp.status_code, resp.text)
         raise HTTPException(502, "Impossible de récupérer la liste des actes INPI")
-    docs = resp.json()
-
-    actes = docs.get('bilans', [])
-    candidats = [a for a in actes if a.get('dateDepot', '').startswith(str(year))]
-    if not candidats:
-        raise HTTPException(404, f"Aucun acte INPI trouvé pour l'année {year}")
-    identifier = candidats[0].get('id')
-    logger.info("Document identifier : %s", identifier)
+    return resp.json().get('bilans', [])
 
+def download_bilan(token: str, identifier: str) -> bytes:
     dl_url = INPI_DOWNLOAD_URL.format(identifier=identifier)
-    r = requests.get(dl_url, auth=BearerAuth(token), timeout=60)
+    with stage_timer("inpi_download"):
+        r = requests.get(dl_url, auth=BearerAuth(token), timeout=60)
     if r.status_code != 200:
         logger.error("INPI download error %s: %s", r.status_code, r.text)
         raise HTTPException(502, "Téléchargement du PDF INPI échoué")
+    PAYLOAD_SIZE.labels("inpi_pdf").observe(len(r.content))
     return r.content
 
+def fetch_pdf_inpi(siren: str, year: str) -> Tuple[str, bytes]:
+    """Renvoie l'identifiant du bilan INPI retenu pour l'année et son PDF."""
+    with stage_timer("inpi_login"):
+        token = get_inpi_token()
+    bilan = select_bilan(list_bilans(token, siren), year)
+    if bilan is None:
+        raise HTTPException(404, f"Aucun acte INPI trouvé pour l'année {year}")
+    identifier = bilan.get('id')
+    logger.info("Document identifier : %s", identifier)
+    return identifier, download_bilan(token, identifier)
+
 # Sélection et extraction de page
 
 def select_page(pdf: bytes) -> int:
     files = {"pdf_file": ("report.pdf", pdf, "application/pdf")}
-    headers = {"accept": "application/json"}
-    r = requests.post(os.getenv("LEGACY_SELECTOR_URL"), files=files, headers=headers, timeout=120)
+    headers = {"accept": "application/json", **trace_headers()}
+    try:
+        with stage_timer("select_page"):
+            r = selector_dependency.call(
+                lambda url: requests.post(url, files=files, headers=headers, timeout=120)
+            )
+    except CircuitOpenError as e:
+        logger.error("Selector unavailable: %s", e)
+        raise HTTPException(503, "Sélecteur de page indisponible")
+    except requests.RequestException as e:
+        logger.error("Selector request failed: %s", e)
+        raise HTTPException(502, "Sélection de la page échouée")
     if r.status_code != 200:
         logger.error("Selector error %s: %s", r.status_code, r.text)
         raise HTTPException(502, "Sélection de la page échouée")
@@ -171,35 +213,122 @@ def extract_page(pdf_bytes: bytes, page_number: int) -> bytes:
     return output_stream.getvalue()
 
 
+def run_marker(snippet: bytes, client_id: str = LLM_CLIENT_ID) -> Dict[str, Any]:
+    files = {"pdf": ("snippet.pdf", snippet, "application/pdf")}
+    headers = {**trace_headers(), CLIENT_ID_HEADER: client_id}
+    try:
+        with stage_timer("marker"):
+            r = marker_dependency.call(
+                lambda url: requests.post(url, files=files, headers=headers, timeout=120)
+            )
+    except CircuitOpenError as e:
+        logger.error("Marker unavailable: %s", e)
+        raise HTTPException(503, "API Marker indisponible")
+    except requests.RequestException as e:
+        logger.error("Marker request failed: %s", e)
+        raise HTTPException(502, "Traitement Marker échoué")
+    if r.status_code != 200:
+        logger.error("Marker error %s: %s", r.status_code, r.text)
+        raise HTTPException(502, "Traitement Marker échoué")
+    PAYLOAD_SIZE.labels("marker_response").observe(len(r.content))
+    return r.json()
+
+
+def process_pdf(pdf: bytes, client_id: str = LLM_CLIENT_ID) -> Tuple[int, Dict[str, Any]]:
+    """Chaîne d'extraction d'un bilan : sélection de la page, extrait PDF, Marker."""
+    page = select_page(pdf)
+    with stage_timer("extract_page"):
+        snippet = extract_page(pdf, page)
+    PAYLOAD_SIZE.labels("snippet_pdf").observe(len(snippet))
+    return page, run_marker(snippet, client_id)
+
+
+def result_filename(siren: str, year: str) -> str:
+    return f"{siren}_{year}.json"
+
+
+def store_result(fs: s3fs.S3FileSystem, siren: str, year: str, page: int,
+                 marker_data: Dict[str, Any], bilan_id: Optional[str] = None):
+    filename = result_filename(siren, year)
+    upload_to_s3(fs, filename, json.dumps({"page": page, "marker": marker_data, "bilan_id": bilan_id}).encode())
+    logger.info(f"Résultat {filename} ajouté à S3.")
+
+
+def prefetch_bilan(siren: str, year: str, identifier: str, pdf: bytes):
+    """Extraction anticipée d'un bilan par le planificateur : le résultat est toujours écrit sur S3."""
+    page, marker_data = process_pdf(pdf, PREFETCH_LLM_CLIENT_ID)
+    store_result(get_s3_fs(), siren, year, page, marker_data, identifier)
+
+
+# Les extractions identiques concurrentes sont dédupliquées (entre workers via verrou local ou S3)
+flights = SingleFlight(build_backend(get_s3_fs, AWS_S3_BUCKET))
+
+# Chaque worker démarre un planificateur ; le verrou du single-flight n'en laisse qu'un actif
+prefetch_scheduler = PrefetchScheduler(
+    fs_factory=get_s3_fs,
+    bucket=AWS_S3_BUCKET,
+    login=get_inpi_token,
+    list_bilans=list_bilans,
+    download=download_bilan,
+    process=prefetch_bilan,
+    lock=flights.backend,
+)
+
+@app.on_event("startup")
+def start_prefetch():
+    if not PREFETCH_WATCHLIST:
+        return
+    prefetch_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_prefetch():
+    prefetch_scheduler.stop()
+
+
+# Options influençant le résultat de la chaîne, incluses dans la clé de déduplication
+# (aucune pour l'instant : seule l'année est paramétrable)
+EXTRACT_CONFIG: Dict[str, Any] = {}
+
+
+def run_extraction(fs: s3fs.S3FileSystem, siren: str, year: str) -> Dict[str, Any]:
+    bilan_id, pdf = fetch_pdf_inpi(siren, year)
+    page, marker_data = process_pdf(pdf)
+    if RESULT_CACHE_ENABLED:
+        store_result(fs, siren, year, page, marker_data, bilan_id)
+    return {"page": page, "marker": marker_data}
+
+
 # Endpoint extraction
 @app.get("/extract/{siren}", response_model=ExtractionResponse)
 def extract(siren: str, year: str = Query(..., description="Année du bilan à récupérer")):
     fs = get_s3_fs()
-    filename = f"{siren}_{year}.json"
+    filename = result_filename(siren, year)
 
-    if False : #file_exists_s3(fs, filename):
+    if RESULT_CACHE_ENABLED and file_exists_s3(fs, filename):
+        RESULT_CACHE_REQUESTS.labels("hit").inc()
         logger.info(f"Le fichier {filename} existe déjà sur S3.")
         raw = fs.open(f"{AWS_S3_BUCKET}/{filename}", 'rb').read()
         data = json.loads(raw)
         page = data.get('page', -1)
         marker_data = data.get('marker', {})
     else:
-        pdf = fetch_pdf_inpi(siren, year)
-        page = select_page(pdf)
-        snippet = extract_page(pdf, page)
-
-        files = {"pdf": ("snippet.pdf", snippet, "application/pdf")}
-        r = requests.post(os.getenv("MARKER_API_URL"), files=files, timeout=120)
-        if r.status_code != 200:
-            logger.error("Marker error %s: %s", r.status_code, r.text)
-            raise HTTPException(502, "Traitement Marker échoué")
-        marker_data = r.json()
-
-        #upload_to_s3(fs, filename, json.dumps({"page": page, "marker": marker_data}).encode())
-        logger.info(f"Résultat {filename} ajouté à S3.")
+        if RESULT_CACHE_ENABLED:
+            RESULT_CACHE_REQUESTS.labels("miss").inc()
+        result, shared = flights.do(
+            flight_key(siren, year, EXTRACT_CONFIG),
+            lambda: run_extraction(fs, siren, year),
+        )
+        if shared:
+            logger.info("Extraction %s/%s partagée avec une requête identique en cours", siren, year)
+        page, marker_data = result["page"], result["marker"]
 
     return ExtractionResponse(siren=siren, year=year, page=page, marker=marker_data)
 
+# Statut du préchargement
+@app.get("/prefetch/status")
+def prefetch_status():
+    return {"enabled": bool(PREFETCH_WATCHLIST), **prefetch_scheduler.status()}
+
 # Endpoint liste fichiers S3
 @app.get("/files", response_model=S3FileListResponse)
 def list_s3_files():
@@ -0,0 +1,369 @@
+"""
+Préchargement des extractions pour une liste de SIREN suivis (watchlist).
+
+Pendant la fenêtre creuse, le planificateur interroge la liste des actes INPI
+de chaque SIREN à un débit borné, détecte les nouveaux bilans (par `id`) et
+exécute la chaîne d'extraction à l'avance : le résultat est écrit dans le
+cache S3, et les appels interactifs à `/extract` deviennent des hits.
+
+L'état (bilans déjà vus, dernier passage, couverture) est conservé sur S3.
+Un seul planificateur est actif à la fois : chaque worker uvicorn en démarre
+un, mais seul celui qui détient le verrou du single-flight (`fcntl` entre les
+workers d'un pod, S3 entre pods) interroge l'INPI ; les autres attendent de
+pouvoir le reprendre.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Fichier listant un SIREN par ligne (chemin local ou s3://bucket/clé) ; vide : préchargement désactivé
+PREFETCH_WATCHLIST = os.getenv("PREFETCH_WATCHLIST", "")
+# Fenêtre creuse (heure locale du conteneur), ex. "22:00-06:00" ; vide : à toute heure
+PREFETCH_WINDOW = os.getenv("PREFETCH_WINDOW", "22:00-06:00")
+# Débit maximal d'appels INPI (connexion, liste des actes, téléchargement) du planificateur
+PREFETCH_INPI_RPM = float(os.getenv("PREFETCH_INPI_RPM", "20"))
+# Délai entre deux passages complets sur la watchlist
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "3600"))
+# Années les plus récentes préchargées à la première rencontre d'un SIREN
+PREFETCH_BACKFILL_YEARS = int(os.getenv("PREFETCH_BACKFILL_YEARS", "1"))
+PREFETCH_STATE_KEY = os.getenv("PREFETCH_STATE_KEY", "prefetch/state.json")
+# Durée de réutilisation du token INPI par le planificateur
+PREFETCH_TOKEN_TTL = float(os.getenv("PREFETCH_TOKEN_TTL", "600"))
+# Délai entre deux tentatives de prise du rôle de planificateur actif, et prolongation de son bail
+PREFETCH_ELECTION_INTERVAL = float(os.getenv("PREFETCH_ELECTION_INTERVAL", "60"))
+PREFETCH_LEASE_RENEWAL = float(os.getenv("PREFETCH_LEASE_RENEWAL", "60"))
+PREFETCH_LEADER_KEY = "prefetch-scheduler"
+
+LAG_BUCKETS = (3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 4 * 86400, 7 * 86400, 14 * 86400, 30 * 86400)
+
+PREFETCH_WATCHLIST_SIZE = Gauge("prefetch_watchlist_size", "SIREN suivis par le préchargement")
+PREFETCH_COVERAGE = Gauge(
+    "prefetch_coverage_ratio",
+    "Part des SIREN suivis dont le dernier bilan publié est déjà extrait en cache",
+)
+PREFETCH_POLL_AGE = Gauge(
+    "prefetch_oldest_poll_age_seconds",
+    "Ancienneté du plus ancien passage sur un SIREN de la watchlist",
+)
+PREFETCH_LAG = Histogram(
+    "prefetch_lag_seconds",
+    "Délai entre le dépôt d'un bilan à l'INPI et la disponibilité de son extraction en cache",
+    buckets=LAG_BUCKETS,
+)
+PREFETCH_POLLS = Counter("prefetch_polls_total", "Interrogations INPI du planificateur", ["result"])
+PREFETCH_BILANS = Counter("prefetch_bilans_total", "Bilans préchargés", ["result"])
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """Décode "HH:MM-HH:MM" en minutes depuis minuit ; None pour une fenêtre vide."""
+    if not window.strip():
+        return None
+    start, end = window.split("-")
+
+    def minutes(value: str) -> int:
+        hours, mins = value.strip().split(":")
+        return int(hours) * 60 + int(mins)
+
+    return minutes(start), minutes(end)
+
+
+def in_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    """Indique si l'heure courante est dans la fenêtre (qui peut passer minuit)."""
+    if window is None:
+        return True
+    now = now or datetime.now()
+    current = now.hour * 60 + now.minute
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def bilan_year(bilan: Dict[str, Any]) -> str:
+    return bilan.get("dateDepot", "")[:4]
+
+
+def select_bilan(bilans: List[Dict[str, Any]], year: str) -> Optional[Dict[str, Any]]:
+    """Bilan retenu pour une année : le premier acte déposé cette année-là (règle de `/extract`)."""
+    candidats = [b for b in bilans if b.get("dateDepot", "").startswith(str(year))]
+    return candidats[0] if candidats else None
+
+
+def deposit_lag(bilan: Dict[str, Any], now: float) -> Optional[float]:
+    try:
+        deposited = datetime.strptime(bilan.get("dateDepot", "")[:10], "%Y-%m-%d").timestamp()
+    except ValueError:
+        return None
+    return max(0.0, now - deposited)
+
+
+class RateLimiter:
+    """Espacement régulier des appels (au plus `rpm` par minute)."""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = 0.0
+
+    def wait(self, stop: threading.Event) -> bool:
+        """Attend le prochain créneau ; renvoie False si l'arrêt est demandé entre-temps."""
+        delay = self._next - time.monotonic()
+        if delay > 0 and stop.wait(delay):
+            return False
+        self._next = max(self._next, time.monotonic()) + self.interval
+        return True
+
+
+class PrefetchScheduler:
+    """
+    Planificateur de préchargement, exécuté dans un thread d'arrière-plan.
+
+    Les étapes de la chaîne sont fournies par l'API centrale :
+    `login()` renvoie un token INPI, `list_bilans(token, siren)` la liste des
+    bilans, `download(token, identifier)` le PDF, et
+    `process(siren, year, identifier, pdf)` extrait et écrit le résultat en cache.
+
+    `lock` est un backend de verrou du single-flight (`try_acquire`, `renew`,
+    `release`) désignant le planificateur actif ; sans verrou, il l'est toujours.
+    """
+
+    def __init__(self, fs_factory: Callable[[], Any], bucket: str,
+                 login: Callable[[], str],
+                 list_bilans: Callable[[str, str], List[Dict[str, Any]]],
+                 download: Callable[[str, str], bytes],
+                 process: Callable[[str, str, str, bytes], None],
+                 watchlist: str = PREFETCH_WATCHLIST, window: str = PREFETCH_WINDOW,
+                 inpi_rpm: float = PREFETCH_INPI_RPM, interval: float = PREFETCH_INTERVAL,
+                 lock=None):
+        self.fs_factory = fs_factory
+        self.bucket = bucket
+        self.login = login
+        self.list_bilans = list_bilans
+        self.download = download
+        self.process = process
+        self.watchlist = watchlist
+        self.window = parse_window(window)
+        self.interval = interval
+        self.limiter = RateLimiter(inpi_rpm)
+        self.lock = lock
+        self.leader = lock is None
+        self._flight = uuid.uuid4().hex
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.sirens: List[str] = []
+        self.last_cycle: Optional[Dict[str, Any]] = None
+        self._token: Optional[str] = None
+        self._token_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def state_path(self) -> str:
+        return f"{self.bucket}/{PREFETCH_STATE_KEY}"
+
+    def load_watchlist(self) -> List[str]:
+        if self.watchlist.startswith("s3://"):
+            with self.fs_factory().open(self.watchlist[len("s3://"):], "r") as f:
+                lines = f.read().splitlines()
+        else:
+            with open(self.watchlist, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        sirens = [line.split("#", 1)[0].strip() for line in lines]
+        return list(dict.fromkeys(s for s in sirens if s))
+
+    def load_state(self):
+        fs = self.fs_factory()
+        if fs.exists(self.state_path):
+            with fs.open(self.state_path, "rb") as f:
+                self.state = json.loads(f.read())
+
+    def save_state(self):
+        self.fs_factory().pipe(self.state_path, json.dumps(self.state).encode())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="prefetch-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _elect(self) -> bool:
+        """Tente de devenir le planificateur actif."""
+        if self.lock is None:
+            return True
+        try:
+            holder = self.lock.try_acquire(PREFETCH_LEADER_KEY, self._flight)
+        except Exception as e:
+            logger.warning("Verrou du planificateur indisponible : %s", e)
+            return False
+        return holder is None or holder == self._flight
+
+    def _keep_lease(self):
+        """Prolonge le bail du verrou ; le rôle est abandonné si le bail est perdu."""
+        while self.leader and not self._stop.wait(PREFETCH_LEASE_RENEWAL):
+            try:
+                renewed = self.lock.renew(PREFETCH_LEADER_KEY, self._flight)
+            except Exception as e:
+                logger.warning("Prolongation du bail du planificateur impossible : %s", e)
+                continue
+            if not renewed:
+                logger.warning("Bail du planificateur de préchargement perdu")
+                self.leader = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._elect():
+                self._stop.wait(PREFETCH_ELECTION_INTERVAL)
+                continue
+            logger.info("Planificateur de préchargement actif dans ce processus")
+            self.leader = True
+            if self.lock is not None:
+                threading.Thread(target=self._keep_lease, name="prefetch-lease", daemon=True).start()
+            try:
+                self._lead()
+            finally:
+                self.leader = False
+                if self.lock is not None:
+                    try:
+                        self.lock.release(PREFETCH_LEADER_KEY, self._flight)
+                    except Exception as e:
+                        logger.warning("Libération du verrou du planificateur impossible : %s", e)
+
+    def _lead(self):
+        # L'état a pu être modifié par le planificateur actif précédent
+        try:
+            self.load_state()
+        except Exception as e:
+            logger.error("État du préchargement illisible, reprise à zéro : %s", e)
+        while self.leader and not self._stop.is_set():
+            if not in_window(self.window):
+                self._stop.wait(60)
+                continue
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.exception("Passage de préchargement interrompu : %s", e)
+            self._stop.wait(self.interval)
+
+    def _inpi_token(self) -> Optional[str]:
+        """Token INPI réutilisé PREFETCH_TOKEN_TTL secondes ; None si l'arrêt est demandé."""
+        if self._token is None or time.monotonic() - self._token_at > PREFETCH_TOKEN_TTL:
+            if not self.limiter.wait(self._stop):
+                return None
+            self._token = self.login()
+            self._token_at = time.monotonic()
+        return self._token
+
+    def run_cycle(self):
+        """Un passage sur la watchlist, en commençant par les SIREN les moins récemment vus."""
+        self.sirens = self.load_watchlist()
+        PREFETCH_WATCHLIST_SIZE.set(len(self.sirens))
+        started = time.time()
+        polled, prefetched = 0, 0
+        for siren in sorted(self.sirens, key=lambda s: self.state.get(s, {}).get("last_poll", 0)):
+            if self._stop.is_set() or not self.leader or not in_window(self.window):
+                break
+            try:
+                prefetched += self.poll(siren)
+                PREFETCH_POLLS.labels("success").inc()
+            except Exception as e:
+                PREFETCH_POLLS.labels("error").inc()
+                logger.error("Préchargement de %s échoué : %s", siren, e)
+            polled += 1
+            if not self.leader:
+                # Rôle repris par un autre processus : l'état sur S3 est désormais le sien
+                break
+            self.save_state()
+            self.update_metrics()
+        self.last_cycle = {
+            "started_at": started,
+            "duration": time.time() - started,
+            "polled": polled,
+            "prefetched": prefetched,
+        }
+        logger.info("Passage de préchargement : %s SIREN interrogés, %s bilans préchargés", polled, prefetched)
+
+    def poll(self, siren: str) -> int:
+        """Interroge les actes d'un SIREN et précharge les bilans nouveaux ; renvoie leur nombre."""
+        token = self._inpi_token()
+        if token is None or not self.limiter.wait(self._stop):
+            return 0
+        bilans = self.list_bilans(token, siren)
+
+        entry = self.state.get(siren)
+        first_seen = entry is None
+        entry = entry or {"seen": [], "prefetched": {}}
+        seen = set(entry["seen"])
+        years = sorted({bilan_year(b) for b in bilans if bilan_year(b)}, reverse=True)
+        if first_seen:
+            targets = years[:PREFETCH_BACKFILL_YEARS]
+        else:
+            targets = [y for y in years if any(b.get("id") not in seen and bilan_year(b) == y for b in bilans)]
+
+        failed, count = set(), 0
+        for index, year in enumerate(targets):
+            bilan = select_bilan(bilans, year)
+            identifier = bilan.get("id")
+            if entry["prefetched"].get(year, {}).get("id") == identifier:
+                continue
+            if not self.leader or self._stop.is_set() or not self.limiter.wait(self._stop):
+                # Arrêt demandé : ce bilan et ceux des années restantes seront traités au passage suivant
+                failed.update(select_bilan(bilans, y).get("id") for y in targets[index:])
+                break
+            try:
+                pdf = self.download(token, identifier)
+                self.process(siren, year, identifier, pdf)
+            except Exception as e:
+                PREFETCH_BILANS.labels("error").inc()
+                logger.error("Extraction anticipée de %s (%s, bilan %s) échouée : %s", siren, year, identifier, e)
+                failed.add(identifier)
+                continue
+            now = time.time()
+            entry["prefetched"][year] = {"id": identifier, "at": now}
+            PREFETCH_BILANS.labels("success").inc()
+            lag = deposit_lag(bilan, now)
+            if lag is not None:
+                PREFETCH_LAG.observe(lag)
+            count += 1
+
+        # Les bilans en échec restent « nouveaux » et seront retentés au passage suivant
+        entry["seen"] = sorted(({b.get("id") for b in bilans} | seen) - failed)
+        entry["last_poll"] = time.time()
+        latest = select_bilan(bilans, years[0]) if years else None
+        entry["latest"] = {"id": latest.get("id"), "year": years[0]} if latest else None
+        entry["covered"] = latest is None or entry["prefetched"].get(years[0], {}).get("id") == latest.get("id")
+        self.state[siren] = entry
+        return count
+
+    def update_metrics(self):
+        entries = [self.state.get(s) for s in self.sirens]
+        if not entries:
+            return
+        covered = sum(1 for e in entries if e and e.get("covered"))
+        PREFETCH_COVERAGE.set(covered / len(entries))
+        oldest = min((e or {}).get("last_poll", 0) for e in entries)
+        if oldest:
+            PREFETCH_POLL_AGE.set(time.time() - oldest)
+
+    def status(self) -> Dict[str, Any]:
+        entries = [self.state.get(s) for s in self.sirens]
+        return {
+            "running": self.running,
+            "leader": self.leader,
+            "in_window": in_window(self.window),
+            "watchlist_size": len(self.sirens),
+            "polled": sum(1 for e in entries if e),
+            "covered": sum(1 for e in entries if e and e.get("covered")),
+            "last_cycle": self.last_cycle,
+        }
@@ -0,0 +1,286 @@
+"""
+Appels résilients aux dépendances (sélecteur de page, API Marker) : requêtes
+couvertes (hedging) vers une autre réplique, disjoncteur par dépendance et
+nouvelles tentatives bornées avec gigue.
+"""
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Set
+
+import requests
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Hedging : requête dupliquée après un délai basé sur le p95 des latences observées
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+# Délai utilisé tant que trop peu de latences ont été observées
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_HEDGES = int(os.getenv("HEDGE_MAX_HEDGES", "1"))
+# Threads des requêtes des dépendances avec hedging (les autres sont appelées dans le thread de l'appelant)
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "64"))
+
+# Disjoncteur : ouvert après N échecs consécutifs, réessai après le délai de réinitialisation
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Nouvelles tentatives (backoff exponentiel avec gigue)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "5"))
+# Seules les erreurs transitoires sont réessayées : connexion impossible et ces statuts.
+# Un délai de lecture dépassé ou une 500 ne le sont pas (la requête a pu être traitée, ou échouera encore).
+RETRY_STATUS_CODES = {int(c) for c in os.getenv("RETRY_STATUS_CODES", "502,503").split(",") if c.strip()}
+
+HEDGES = Counter("dependency_hedges_total", "Requêtes couvertes envoyées", ["dependency"])
+HEDGE_WINS = Counter("dependency_hedge_wins_total", "Requêtes couvertes arrivées en premier", ["dependency"])
+RETRIES = Counter("dependency_retries_total", "Nouvelles tentatives", ["dependency"])
+BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "État du disjoncteur (0 : fermé, 1 : semi-ouvert, 2 : ouvert)",
+    ["dependency"],
+)
+BREAKER_TRANSITIONS = Counter("circuit_breaker_transitions_total", "Changements d'état du disjoncteur",
+                              ["dependency", "state"])
+BREAKER_REJECTIONS = Counter("circuit_breaker_rejections_total", "Appels refusés disjoncteur ouvert",
+                             ["dependency"])
+
+# Requêtes des dépendances avec hedging ; les requêtes perdantes ne peuvent pas être
+# annulées : elles se terminent en arrière-plan
+_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(Exception):
+    """La dépendance est considérée indisponible : l'appel échoue immédiatement."""
+
+
+def urls_from_env(list_var: str, single_var: str) -> List[str]:
+    """Répliques d'une dépendance : liste séparée par des virgules, sinon URL unique."""
+    urls = [u.strip() for u in (os.getenv(list_var) or "").split(",") if u.strip()]
+    return urls or [os.getenv(single_var)]
+
+
+class LatencyTracker:
+    """Fenêtre glissante des latences réussies, pour calculer le délai de hedging."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            values = sorted(self._samples)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class CircuitBreaker:
+    """Disjoncteur fermé / ouvert / semi-ouvert (un seul appel d'essai en semi-ouvert)."""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(0)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning("Disjoncteur %s : %s → %s", self.name, self.state, state)
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(self._GAUGE[state])
+        BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+
+def _is_failure(resp: requests.Response) -> bool:
+    return resp.status_code >= 500
+
+
+def _is_retryable_error(error: requests.RequestException) -> bool:
+    # ConnectTimeout hérite de ConnectionError ; ReadTimeout non
+    return isinstance(error, requests.ConnectionError)
+
+
+class Dependency:
+    """
+    Dépendance HTTP répliquée, appelée avec hedging, disjoncteur et nouvelles tentatives.
+
+    `request_fn(url)` effectue la requête vers une réplique et renvoie la réponse ;
+    avec hedging, il s'exécute dans un thread du pool de hedging (le contexte de
+    trace doit donc être capturé par l'appelant).
+
+    Le hedging n'est actif qu'avec plusieurs répliques. Un appel logique envoie
+    au plus `1 + HEDGE_MAX_HEDGES` requêtes, requêtes couvertes et nouvelles
+    tentatives comprises (une requête abandonnée côté client peut continuer
+    d'occuper la dépendance).
+    """
+
+    def __init__(self, name: str, urls: List[str], hedging: bool = HEDGE_ENABLED,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS, retry_statuses: Set[int] = frozenset(RETRY_STATUS_CODES)):
+        self.name = name
+        self.urls = urls
+        self.hedging = hedging and HEDGE_MAX_HEDGES > 0 and len(urls) > 1
+        self.max_attempts = max(1, max_attempts)
+        self.retry_statuses = set(retry_statuses)
+        self.max_requests = 1 + max(0, HEDGE_MAX_HEDGES)
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        self._next_replica = itertools.count()
+
+    def hedge_delay(self) -> float:
+        observed = self.latency.quantile(HEDGE_QUANTILE)
+        return max(HEDGE_MIN_DELAY, observed) if observed is not None else HEDGE_DEFAULT_DELAY
+
+    def _hedged(self, request_fn: Callable[[str], requests.Response], remaining: List[int]) -> requests.Response:
+        """Une tentative : requête principale puis requêtes couvertes, dans la limite de `remaining[0]` envois."""
+        offset = next(self._next_replica)
+        if not self.hedging:
+            remaining[0] -= 1
+            return request_fn(self.urls[offset % len(self.urls)])
+
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        futures = {}
+        # Instant d'envoi effectif de chaque requête : l'attente d'un thread libre
+        # du pool ne compte pas dans le délai de hedging ni dans les latences
+        sent_at: List[Optional[float]] = []
+
+        def send(index: int, url: str) -> requests.Response:
+            sent_at[index] = time.perf_counter()
+            return request_fn(url)
+
+        def launch(index: int):
+            remaining[0] -= 1
+            sent_at.append(None)
+            url = self.urls[(offset + index) % len(self.urls)]
+            future = _executor.submit(send, index, url)
+            futures[future] = index
+            return future
+
+        pending = {launch(0)}
+        hedges = 0
+        last_resp, last_error = None, None
+        while pending:
+            can_hedge = hedges < HEDGE_MAX_HEDGES and remaining[0] > 0
+            timeout = None
+            if can_hedge:
+                # Requête couverte `delay` après l'envoi effectif de la précédente
+                last_sent = sent_at[hedges]
+                timeout = delay if last_sent is None else max(0.0, last_sent + delay - time.perf_counter())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                last_sent = sent_at[hedges]
+                if last_sent is None or time.perf_counter() < last_sent + delay:
+                    continue
+                hedges += 1
+                HEDGES.labels(self.name).inc()
+                logger.info("Hedging %s après %.1fs", self.name, time.perf_counter() - start)
+                pending.add(launch(hedges))
+                continue
+            for future in done:
+                try:
+                    resp = future.result()
+                except requests.RequestException as e:
+                    last_error = e
+                    continue
+                if _is_failure(resp):
+                    last_resp = resp
+                    continue
+                index = futures[future]
+                self.latency.record(time.perf_counter() - sent_at[index])
+                if index > 0:
+                    HEDGE_WINS.labels(self.name).inc()
+                return resp
+        if last_resp is not None:
+            return last_resp
+        raise last_error
+
+    def call(self, request_fn: Callable[[str], requests.Response]) -> requests.Response:
+        """
+        Appelle la dépendance et renvoie la première réponse valide.
+
+        Seules les erreurs de connexion et les statuts `retry_statuses` sont
+        réessayés, tant que le budget d'envois de l'appel n'est pas épuisé ;
+        sinon la dernière réponse 5xx est renvoyée ou l'exception relevée.
+
+        Raises:
+            CircuitOpenError: si le disjoncteur de la dépendance est ouvert
+        """
+        last_resp, last_error = None, None
+        remaining = [self.max_requests]
+        for attempt in range(1, self.max_attempts + 1):
+            if not self.breaker.allow():
+                BREAKER_REJECTIONS.labels(self.name).inc()
+                raise CircuitOpenError(f"Dépendance {self.name} indisponible (disjoncteur ouvert)")
+            try:
+                resp = self._hedged(request_fn, remaining)
+            except requests.RequestException as e:
+                last_resp, last_error = None, e
+                retryable = _is_retryable_error(e)
+            except BaseException:
+                # Toute autre erreur compte comme un échec (et termine l'appel d'essai en semi-ouvert)
+                self.breaker.record_failure()
+                raise
+            else:
+                if not _is_failure(resp):
+                    self.breaker.record_success()
+                    return resp
+                last_resp, last_error = resp, None
+                retryable = resp.status_code in self.retry_statuses
+            self.breaker.record_failure()
+            if not retryable or attempt == self.max_attempts or remaining[0] <= 0:
+                break
+            RETRIES.labels(self.name).inc()
+            backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            time.sleep(random.uniform(0, backoff))
+        if last_resp is not None:
+            return last_resp
+        raise last_error
@@ -0,0 +1,297 @@
+"""
+Déduplication des extractions identiques en cours (single-flight).
+
+La première requête pour une clé (siren, année, configuration) exécute la
+chaîne ; les requêtes identiques qui arrivent pendant ce temps attendent son
+résultat au lieu de refaire connexion INPI, téléchargement, sélection et Marker.
+
+Dans un processus, les requêtes en attente partagent un Future. Entre workers
+uvicorn (ou entre pods), un verrou léger désigne le meneur : `fcntl` sur le
+système de fichiers local ou objet verrou sur S3. Le meneur y dépose le
+résultat, que les autres processus relisent. Si le meneur échoue ou disparaît
+sans résultat, un processus en attente reprend la main.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+# local : verrou fcntl (workers d'un même pod) ; s3 : verrou sur le bucket (plusieurs pods) ;
+# none : déduplication limitée au processus
+SINGLEFLIGHT_BACKEND = os.getenv("SINGLEFLIGHT_BACKEND", "local")
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", "/tmp/singleflight")
+SINGLEFLIGHT_S3_PREFIX = os.getenv("SINGLEFLIGHT_S3_PREFIX", "singleflight")
+# Durée du bail d'un verrou S3 (un meneur disparu ne bloque pas au-delà)
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("SINGLEFLIGHT_LOCK_TTL", "300"))
+# Attente maximale du résultat d'un autre processus, et intervalle de consultation
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "600"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.5"))
+# Conservation du résultat partagé après la fin de l'exécution, pour les processus en attente
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", "60"))
+
+DEDUPLICATED = Counter(
+    "singleflight_deduplicated_total",
+    "Requêtes servies par l'exécution d'une requête identique en cours",
+    ["scope"],
+)
+TAKEOVERS = Counter(
+    "singleflight_takeovers_total",
+    "Reprises après un meneur terminé sans résultat partagé",
+)
+
+
+def flight_key(siren: str, year: str, config: Optional[Dict[str, Any]] = None) -> str:
+    raw = json.dumps({"siren": siren, "year": str(year), "config": config or {}}, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class LocalLockBackend:
+    """Verrous `fcntl.flock` et résultats dans un répertoire local partagé par les workers."""
+
+    def __init__(self, directory: str = SINGLEFLIGHT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._held: Dict[str, Any] = {}
+        # Résultats laissés par un processus arrêté avant leur suppression différée
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".json") and time.time() - os.path.getmtime(path) > SINGLEFLIGHT_RESULT_TTL:
+                os.remove(path)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.lock")
+
+    def _result_path(self, key: str, flight: str) -> str:
+        return os.path.join(self.directory, f"{key}.{flight}.json")
+
+    def try_acquire(self, key: str, flight: str) -> Optional[str]:
+        """Prend le verrou (renvoie None) ou renvoie l'identifiant d'exécution du meneur."""
+        f = open(self._lock_path(key), "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            holder = f.read().strip()
+            f.close()
+            return holder
+        f.seek(0)
+        f.truncate()
+        f.write(flight)
+        f.flush()
+        self._held[key] = f
+        return None
+
+    def renew(self, key: str, flight: str) -> bool:
+        """Le verrou `flock` est conservé tant que le fichier est ouvert : rien à prolonger."""
+        return key in self._held
+
+    def release(self, key: str, flight: str):
+        f = self._held.pop(key, None)
+        if f is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def held(self, key: str) -> bool:
+        with open(self._lock_path(key), "a+") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def publish(self, key: str, flight: str, payload: bytes):
+        path = self._result_path(key, flight)
+        with open(path + ".tmp", "wb") as f:
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+
+    def fetch(self, key: str, flight: str) -> Optional[bytes]:
+        try:
+            with open(self._result_path(key, flight), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def discard(self, key: str, flight: str):
+        try:
+            os.remove(self._result_path(key, flight))
+        except FileNotFoundError:
+            pass
+
+
+class S3LockBackend:
+    """
+    Verrous à bail et résultats sous un préfixe du bucket S3, pour plusieurs pods.
+
+    L'écriture du verrou n'est pas atomique : deux meneurs peuvent exceptionnellement
+    s'élire en même temps (les extractions sont alors simplement dupliquées).
+    """
+
+    def __init__(self, fs_factory: Callable[[], Any], bucket: str, prefix: str = SINGLEFLIGHT_S3_PREFIX):
+        self.fs_factory = fs_factory
+        self.base = f"{bucket}/{prefix}"
+
+    def _read_lock(self, fs, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            lock = json.loads(fs.cat(f"{self.base}/{key}.lock"))
+        except FileNotFoundError:
+            return None
+        return lock if lock.get("expires", 0) > time.time() else None
+
+    def try_acquire(self, key: str, flight: str) -> Optional[str]:
+        fs = self.fs_factory()
+        lock = self._read_lock(fs, key)
+        if lock is not None:
+            return lock["flight"]
+        fs.pipe(f"{self.base}/{key}.lock",
+                json.dumps({"flight": flight, "expires": time.time() + SINGLEFLIGHT_LOCK_TTL}).encode())
+        # Relecture : en cas d'écritures concurrentes, la dernière l'emporte
+        lock = self._read_lock(fs, key)
+        if lock is not None and lock["flight"] != flight:
+            return lock["flight"]
+        return None
+
+    def renew(self, key: str, flight: str) -> bool:
+        """Prolonge le bail d'un verrou détenu ; False s'il a été repris par un autre processus."""
+        fs = self.fs_factory()
+        lock = self._read_lock(fs, key)
+        if lock is not None and lock["flight"] != flight:
+            return False
+        fs.pipe(f"{self.base}/{key}.lock",
+                json.dumps({"flight": flight, "expires": time.time() + SINGLEFLIGHT_LOCK_TTL}).encode())
+        return True
+
+    def release(self, key: str, flight: str):
+        fs = self.fs_factory()
+        lock = self._read_lock(fs, key)
+        if lock is not None and lock["flight"] == flight:
+            fs.rm(f"{self.base}/{key}.lock")
+
+    def held(self, key: str) -> bool:
+        return self._read_lock(self.fs_factory(), key) is not None
+
+    def publish(self, key: str, flight: str, payload: bytes):
+        self.fs_factory().pipe(f"{self.base}/{key}.{flight}.json", payload)
+
+    def fetch(self, key: str, flight: str) -> Optional[bytes]:
+        try:
+            return self.fs_factory().cat(f"{self.base}/{key}.{flight}.json")
+        except FileNotFoundError:
+            return None
+
+    def discard(self, key: str, flight: str):
+        try:
+            self.fs_factory().rm(f"{self.base}/{key}.{flight}.json")
+        except FileNotFoundError:
+            pass
+
+
+def build_backend(fs_factory: Callable[[], Any], bucket: str, kind: str = SINGLEFLIGHT_BACKEND):
+    if kind == "local":
+        return LocalLockBackend()
+    if kind == "s3":
+        return S3LockBackend(fs_factory, bucket)
+    return None
+
+
+class SingleFlight:
+    """
+    Exécute `fn` une seule fois par clé parmi les appels concurrents.
+
+    `fn` doit renvoyer un dictionnaire sérialisable en JSON (partagé entre processus).
+    Les exceptions du meneur sont relevées pour les appels en attente du même
+    processus ; les autres processus reprennent l'exécution.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """Renvoie (résultat, partagé) ; `partagé` indique un résultat obtenu d'une autre requête."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            DEDUPLICATED.labels("process").inc()
+            return future.result(), True
+
+        try:
+            result, shared = self._run_shared(key, fn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, shared
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _run_shared(self, key: str, fn: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        if self.backend is None:
+            return fn(), False
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT_TIMEOUT
+        waited = False
+        while True:
+            flight = uuid.uuid4().hex
+            try:
+                holder = self.backend.try_acquire(key, flight)
+            except Exception as e:
+                logger.warning("Verrou single-flight indisponible, exécution directe : %s", e)
+                return fn(), False
+            if holder is None:
+                if waited:
+                    TAKEOVERS.inc()
+                return self._lead(key, flight, fn), False
+            if not holder:
+                # Verrou pris mais identifiant du meneur pas encore écrit
+                time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+                continue
+            waited = True
+            payload = self._wait(key, holder, deadline)
+            if payload is not None:
+                DEDUPLICATED.labels("shared").inc()
+                return json.loads(payload), True
+            if time.monotonic() > deadline:
+                logger.warning("Attente du meneur single-flight dépassée, exécution directe")
+                return fn(), False
+
+    def _lead(self, key: str, flight: str, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            result = fn()
+            try:
+                self.backend.publish(key, flight, json.dumps(result).encode())
+                timer = threading.Timer(SINGLEFLIGHT_RESULT_TTL, self.backend.discard, args=(key, flight))
+                timer.daemon = True
+                timer.start()
+            except Exception as e:
+                logger.warning("Publication du résultat single-flight impossible : %s", e)
+            return result
+        finally:
+            self.backend.release(key, flight)
+
+    def _wait(self, key: str, holder: str, deadline: float) -> Optional[bytes]:
+        """Attend le résultat du meneur ; None s'il a rendu le verrou sans résultat."""
+        while time.monotonic() < deadline:
+            payload = self.backend.fetch(key, holder)
+            if payload is not None:
+                return payload
+            if not self.backend.held(key):
+                return self.backend.fetch(key, holder)
+            time.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        return None
@@ -0,0 +1,105 @@
+"""
+Tests du planificateur de préchargement (arrêt en cours de passage, élection entre workers).
+
+    pip install pytest prometheus_client
+    python -m pytest api_centrale/tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "api_centrale"))
+
+import prefetch  # noqa: E402
+from prefetch import PrefetchScheduler  # noqa: E402
+from singleflight import LocalLockBackend  # noqa: E402
+
+BILANS = [
+    {"id": "b2023", "dateDepot": "2024-06-30"},
+    {"id": "b2022", "dateDepot": "2023-06-30"},
+    {"id": "b2021", "dateDepot": "2022-06-30"},
+]
+
+
+class FakeFS:
+    def __init__(self):
+        self.files = {}
+
+    def exists(self, path):
+        return path in self.files
+
+    def pipe(self, path, data):
+        self.files[path] = data
+
+
+def scheduler(watchlist, process, lock=None, calls=None, name="worker"):
+    fs = FakeFS()
+
+    def list_bilans(token, siren):
+        if calls is not None:
+            calls.append(name)
+        return [dict(b) for b in BILANS]
+
+    return PrefetchScheduler(
+        fs_factory=lambda: fs, bucket="bucket",
+        login=lambda: "token", list_bilans=list_bilans,
+        download=lambda token, identifier: b"%PDF", process=process,
+        watchlist=str(watchlist), window="", inpi_rpm=0, interval=0.05, lock=lock,
+    )
+
+
+@pytest.fixture
+def watchlist(tmp_path):
+    path = tmp_path / "watchlist.txt"
+    path.write_text("123456789\n")
+    return path
+
+
+def test_stop_mid_poll_keeps_remaining_years_new(monkeypatch, watchlist):
+    monkeypatch.setattr(prefetch, "PREFETCH_BACKFILL_YEARS", 3)
+    processed = []
+
+    def process(siren, year, identifier, pdf):
+        processed.append(identifier)
+        s.stop()
+
+    s = scheduler(watchlist, process)
+    assert s.poll("123456789") == 1
+    entry = s.state["123456789"]
+    assert processed == ["b2023"]
+    assert entry["seen"] == ["b2023"]
+
+    # Au passage suivant, les années non traitées sont reprises
+    s._stop.clear()
+    s.process = lambda siren, year, identifier, pdf: processed.append(identifier)
+    assert s.poll("123456789") == 2
+    assert processed == ["b2023", "b2022", "b2021"]
+    assert entry["seen"] == ["b2021", "b2022", "b2023"]
+
+
+def test_single_scheduler_is_active_across_workers(monkeypatch, tmp_path, watchlist):
+    monkeypatch.setattr(prefetch, "PREFETCH_ELECTION_INTERVAL", 0.05)
+    calls = []
+    workers = {
+        name: scheduler(watchlist, lambda *args: None, LocalLockBackend(str(tmp_path / "locks")), calls, name)
+        for name in ("a", "b")
+    }
+    for worker in workers.values():
+        worker.start()
+    time.sleep(0.5)
+    leaders = [name for name, worker in workers.items() if worker.leader]
+    assert len(leaders) == 1
+    assert set(calls) == set(leaders)
+
+    # Le worker actif s'arrête : l'autre reprend le rôle
+    workers[leaders[0]].stop()
+    workers[leaders[0]]._thread.join(timeout=2)
+    calls.clear()
+    time.sleep(0.5)
+    (other,) = set(workers) - set(leaders)
+    assert workers[other].leader
+    assert calls and set(calls) == {other}
+    workers[other].stop()
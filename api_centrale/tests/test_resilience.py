@@ -0,0 +1,140 @@
+"""
+Tests des appels résilients (hedging, disjoncteur, nouvelles tentatives) avec des requêtes simulées.
+
+    pip install pytest requests prometheus_client
+    python -m pytest api_centrale/tests
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "api_centrale"))
+
+import resilience  # noqa: E402
+from resilience import CircuitBreaker, CircuitOpenError, Dependency  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.0)
+    monkeypatch.setattr(resilience, "HEDGE_DEFAULT_DELAY", 0.1)
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY", 0.1)
+
+
+def response(status: int, url: str = "") -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp.url = url
+    return resp
+
+
+class FakeReplicas:
+    """`request_fn` simulé : comportement par URL, appels enregistrés."""
+
+    def __init__(self, behaviours):
+        self.behaviours = behaviours
+        self.calls = []
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        with self._lock:
+            self.calls.append(url)
+            self.threads.append(threading.get_ident())
+            behaviour = self.behaviours[url]
+            if isinstance(behaviour, list):
+                behaviour = behaviour.pop(0)
+        if isinstance(behaviour, tuple):
+            delay, behaviour = behaviour
+            time.sleep(delay)
+        if isinstance(behaviour, BaseException):
+            raise behaviour
+        return response(behaviour, url)
+
+
+def test_single_replica_is_called_inline_once():
+    replicas = FakeReplicas({"a": (0.3, 200)})
+    dependency = Dependency("single", ["a"])
+    assert not dependency.hedging
+    assert dependency.call(replicas).status_code == 200
+    assert replicas.calls == ["a"]
+    assert replicas.threads == [threading.get_ident()]
+
+
+def test_hedge_goes_to_another_replica_and_first_valid_response_wins():
+    replicas = FakeReplicas({"a": (1.0, 200), "b": (0.0, 200)})
+    dependency = Dependency("hedged", ["a", "b"])
+    t0 = time.perf_counter()
+    resp = dependency.call(replicas)
+    assert resp.url == "b"
+    assert replicas.calls == ["a", "b"]
+    assert time.perf_counter() - t0 < 0.5
+
+
+def test_hedge_delay_starts_when_the_request_is_sent(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(resilience, "_executor", executor)
+    release = threading.Event()
+    executor.submit(release.wait)
+    threading.Timer(0.3, release.set).start()
+    replicas = FakeReplicas({"a": (0.05, 200), "b": (0.0, 200)})
+    dependency = Dependency("queued", ["a", "b"])
+    assert dependency.call(replicas).url == "a"
+    assert replicas.calls == ["a"]
+    executor.shutdown()
+
+
+def test_connection_errors_and_retry_statuses_are_retried():
+    replicas = FakeReplicas({"a": [requests.ConnectionError("refused"), 200]})
+    assert Dependency("retry-conn", ["a"]).call(replicas).status_code == 200
+    replicas = FakeReplicas({"a": [503, 200]})
+    assert Dependency("retry-503", ["a"]).call(replicas).status_code == 200
+    assert len(replicas.calls) == 2
+
+
+def test_read_timeouts_and_500_are_not_retried():
+    replicas = FakeReplicas({"a": [requests.ReadTimeout("slow"), 200]})
+    with pytest.raises(requests.ReadTimeout):
+        Dependency("no-retry-timeout", ["a"]).call(replicas)
+    replicas = FakeReplicas({"a": [500, 200]})
+    assert Dependency("no-retry-500", ["a"]).call(replicas).status_code == 500
+    assert len(replicas.calls) == 1
+
+
+def test_hedges_and_retries_share_the_request_budget():
+    replicas = FakeReplicas({"a": (0.2, 503), "b": (0.2, 503)})
+    dependency = Dependency("budget", ["a", "b"], max_attempts=5)
+    assert dependency.call(replicas).status_code == 503
+    time.sleep(0.3)
+    assert len(replicas.calls) == dependency.max_requests == 1 + resilience.HEDGE_MAX_HEDGES
+
+
+def test_breaker_opens_after_consecutive_failures():
+    dependency = Dependency("breaker", ["a"], max_attempts=1)
+    dependency.breaker = CircuitBreaker("breaker", failure_threshold=2, reset_timeout=60)
+    replicas = FakeReplicas({"a": 500})
+    for _ in range(2):
+        dependency.call(replicas)
+    with pytest.raises(CircuitOpenError):
+        dependency.call(replicas)
+    assert len(replicas.calls) == 2
+
+
+def test_half_open_trial_raising_unexpected_error_does_not_wedge_the_breaker():
+    dependency = Dependency("trial", ["a"], max_attempts=1)
+    dependency.breaker = CircuitBreaker("trial", failure_threshold=1, reset_timeout=0.05)
+    dependency.call(FakeReplicas({"a": 500}))
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    with pytest.raises(ValueError):
+        dependency.call(FakeReplicas({"a": ValueError("bad payload")}))
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert dependency.call(FakeReplicas({"a": 200})).status_code == 200
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,90 @@
+"""
+Benchmark du pool de workers Marker : pages par minute selon le nombre de workers.
+
+Exemple :
+    python benchmark_pool.py --pdf-dir samples/ --workers 1,2,4 --output bench_pool.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+from worker_pool import MarkerWorkerPool, build_marker_config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run(pdf_paths, n_workers, torch_threads, cpu_pinning, force_ocr, use_llm, repeat):
+    """Traite `repeat` fois l'ensemble des pages avec un pool de `n_workers` workers."""
+    pool = MarkerWorkerPool(n_workers=n_workers, torch_threads=torch_threads, cpu_pinning=cpu_pinning)
+    t0 = time.perf_counter()
+    pool.start()
+    pool.wait_ready()
+    startup = time.perf_counter() - t0
+
+    config = build_marker_config(force_ocr=force_ocr, use_llm=use_llm)
+    tasks = pdf_paths * repeat
+    t0 = time.perf_counter()
+    futures = [pool.submit(path, config) for path in tasks]
+    conversions, errors = [], 0
+    for future in futures:
+        try:
+            _, timings = future.result()
+            conversions.append(timings["conversion"])
+        except Exception as e:
+            logger.error("Conversion échouée : %s", e)
+            errors += 1
+    elapsed = time.perf_counter() - t0
+    pool.shutdown()
+
+    return {
+        "workers": n_workers,
+        "torch_threads": torch_threads or len(pool.core_subsets[0]),
+        "cpu_pinning": cpu_pinning,
+        "pages": len(tasks),
+        "errors": errors,
+        "startup_s": round(startup, 2),
+        "elapsed_s": round(elapsed, 2),
+        "pages_per_minute": round(60 * (len(tasks) - errors) / elapsed, 2),
+        "mean_conversion_s": round(sum(conversions) / len(conversions), 3) if conversions else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du pool de workers Marker")
+    parser.add_argument("--pdf-dir", required=True, help="Répertoire de PDF monopages d'exemple")
+    parser.add_argument("--workers", default="1,2,4", help="Nombres de workers à tester (séparés par des virgules)")
+    parser.add_argument("--torch-threads", type=int, default=0, help="Threads torch par worker (0 : cœurs attribués)")
+    parser.add_argument("--no-pinning", action="store_true", help="Désactiver l'épinglage CPU")
+    parser.add_argument("--force-ocr", action="store_true", help="Forcer l'OCR")
+    parser.add_argument("--use-llm", action="store_true", help="Activer les processeurs LLM (via PROXY_URL)")
+    parser.add_argument("--repeat", type=int, default=1, help="Nombre de passes sur les pages d'exemple")
+    parser.add_argument("--output", help="Fichier JSON de résultats")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf")))
+    if not pdf_paths:
+        raise SystemExit(f"Aucun PDF trouvé dans {args.pdf_dir}")
+
+    results = []
+    for n_workers in [int(n) for n in args.workers.split(",")]:
+        result = run(pdf_paths, n_workers, args.torch_threads, not args.no_pinning,
+                     args.force_ocr, args.use_llm, args.repeat)
+        logger.info("%s", result)
+        results.append(result)
+
+    print(f"{'workers':>8} {'threads':>8} {'pages':>6} {'pages/min':>10} {'conv moy (s)':>13}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['torch_threads']:>8} {r['pages']:>6} "
+              f"{r['pages_per_minute']:>10} {r['mean_conversion_s']!s:>13}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+_IMPORT_START = time.perf_counter()
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.responses import JSONResponse
 import shutil
 import tempfile
 import os
 import json
+import logging
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
 from dotenv import load_dotenv
-from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
-from marker.config.parser import ConfigParser
 import fitz  # PyMuPDF
 from PIL import Image
 import io
+from text_layer import OCR_MODES, analyse_text_layer, choose_extraction_mode
+from worker_pool import MarkerWorkerPool, build_marker_config
+from vlm_engine import extract_tables
+from observability import PAYLOAD_SIZE, STAGE_DURATION, setup_observability, stage_timer, trace_headers
+from profiler import active_interval, setup_profiler
+
+# Mode d'extraction par défaut : "auto" (détection de la couche texte), "ocr" ou "native"
+DEFAULT_OCR_MODE = os.getenv("MARKER_OCR_MODE", "auto")
+# Durée maximale d'une conversion Marker (attente dans la file comprise)
+MARKER_TASK_TIMEOUT = float(os.getenv("MARKER_TASK_TIMEOUT", "900"))
+# Moteurs d'extraction : pipeline Marker ou envoi direct des pages à un VLM
+ENGINES = ("marker", "vlm")
+DEFAULT_ENGINE = os.getenv("EXTRACTION_ENGINE", "marker")
+# Nombre de workers Marker prêts requis pour que le pod reçoive du trafic (0 : tous)
+MARKER_READY_MIN_WORKERS = int(os.getenv("MARKER_READY_MIN_WORKERS", "0"))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="API Marker PDF Extraction",
@@ -20,6 +41,52 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc"
 )
+setup_observability(app)
+setup_profiler(app)
+
+# Pool de workers Marker (modèles chargés une fois par processus)
+pool = MarkerWorkerPool()
+
+
+@app.on_event("startup")
+def startup_event():
+    """Démarrage des workers Marker : chargement des modèles et warm-up en arrière-plan."""
+    logger.info("Phase de démarrage 'imports_api' : %.2fs", time.perf_counter() - _IMPORT_START)
+    t0 = time.perf_counter()
+    pool.start()
+    logger.info("Phase de démarrage 'spawn_workers' : %.2fs", time.perf_counter() - t0)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Arrêt des workers Marker."""
+    pool.shutdown()
+
+
+# Sondes en `async def` : exécutées dans la boucle d'événements, elles ne dépendent pas
+# des threads du pool occupés par les appels `/extract` en attente de Marker
+@app.get("/live")
+async def live():
+    """Sonde de vivacité : le processus répond et le pool de workers est supervisé."""
+    if not pool.alive:
+        raise HTTPException(status_code=503, detail="Marker worker pool is not running")
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Sonde de disponibilité : les modèles Marker sont chargés et préchauffés."""
+    required = MARKER_READY_MIN_WORKERS or pool.n_workers
+    body = {
+        "ready_workers": pool.ready_workers,
+        "workers": pool.n_workers,
+        "startup_phases": pool.startup_phases,
+    }
+    if pool.ready_workers < required:
+        return JSONResponse(status_code=503, content={"status": "warming_up", **body})
+    return {"status": "ready", **body}
+
+
 def pdf_to_image(pdf_path, output_dir, dpi=300):
     """
     Convertit un PDF monopage en image
@@ -67,65 +134,115 @@ def pdf_to_image(pdf_path, output_dir, dpi=300):
         raise Exception(f"Erreur lors de la conversion PDF vers image: {str(e)}")
 
 @app.post("/extract")
-def extract(pdf: UploadFile = File(...)):
+def extract(
+    pdf: UploadFile = File(...),
+    ocr_mode: str = Form(DEFAULT_OCR_MODE, description="Mode d'extraction : auto, ocr ou native"),
+    engine: str = Form(DEFAULT_ENGINE, description="Moteur d'extraction : marker ou vlm"),
+    x_client_id: Optional[str] = Header(None, description="Client appelant, transmis au proxy LLM (budgets de tokens)"),
+):
     # Vérification du type
     if pdf.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Invalid file type. PDF required.")
-    
+    if ocr_mode not in OCR_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid ocr_mode. Expected one of: {', '.join(OCR_MODES)}")
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"Invalid engine. Expected one of: {', '.join(ENGINES)}")
+
+    timings = {}
+    start = time.perf_counter()
+    llm_headers = trace_headers()
+    if x_client_id:
+        llm_headers["x-client-id"] = x_client_id
+
     # Création d'un répertoire de travail temporaire
     with tempfile.TemporaryDirectory() as tmpdir:
         # Sauvegarde du PDF
         input_pdf_path = os.path.join(tmpdir, pdf.filename)
         with open(input_pdf_path, "wb") as f:
             shutil.copyfileobj(pdf.file, f)
-        
-        # Conversion du PDF en image
+        PAYLOAD_SIZE.labels("input_pdf").observe(os.path.getsize(input_pdf_path))
+
+        # Moteur VLM : toutes les pages sont envoyées directement au modèle, sans Marker
+        if engine == "vlm":
+            try:
+                with stage_timer("vlm"):
+                    result = asyncio.run(extract_tables(input_pdf_path, headers=llm_headers))
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"VLM extraction failed: {e}")
+            timings.update(result.pop("timings"))
+            timings["total"] = time.perf_counter() - start
+            result["engine"] = engine
+            result["timings"] = {key: round(value, 3) for key, value in timings.items()}
+            logger.info("Extraction vlm terminée : %s", result["timings"])
+            response = JSONResponse(content=result)
+            PAYLOAD_SIZE.labels("extraction_response").observe(len(response.body))
+            return response
+
+        if pool.n_workers == 0:
+            raise HTTPException(status_code=503, detail="Marker engine disabled (MARKER_WORKERS=0)")
+
+        # Détection de la couche texte pour choisir entre OCR et extraction native
+        t0 = time.perf_counter()
         try:
-            image_path = pdf_to_image(input_pdf_path, tmpdir)
-            print(f"PDF converti en image: {image_path}")
+            text_layer = analyse_text_layer(input_pdf_path)
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Erreur de conversion PDF vers image: {str(e)}")
-        
-        # Configuration de Marker pour produire du JSON et forcer l'OCR + LLM
-        config = {
-            "output_format": "json",
-            "force_ocr": True,
-            "use_llm": True,
-            "llm_service": "marker.services.openai.OpenAIService",
-            "openai_base_url": os.getenv("PROXY_URL"),
-            "openai_model": "gemma3:27b",
-            "openai_api_key": os.getenv("REAL_LLM_API_KEY"),
-            "timeout": 99999,
-        }
-        
-        parser = ConfigParser(config)
-        
-        # Instanciation du converter
-        converter = PdfConverter(
-            config=parser.generate_config_dict(),
-            artifact_dict=create_model_dict(),
-            processor_list=parser.get_processors(),
-            renderer=parser.get_renderer(),
-            llm_service=parser.get_llm_service()
-        )
-        
-        # Exécution de la conversion (on continue à utiliser le PDF original pour Marker)
+            raise HTTPException(status_code=400, detail=f"Erreur d'analyse de la couche texte: {str(e)}")
+        mode = choose_extraction_mode(text_layer, ocr_mode)
+        timings["text_layer_check"] = time.perf_counter() - t0
+        STAGE_DURATION.labels("text_layer_check").observe(timings["text_layer_check"])
+        logger.info("Mode d'extraction : %s (demandé : %s)", mode, ocr_mode)
+
+        # Conversion du PDF en image (inutile quand la couche texte native est exploitée)
+        image_path = None
+        if mode == "ocr":
+            t0 = time.perf_counter()
+            try:
+                image_path = pdf_to_image(input_pdf_path, tmpdir)
+                logger.info("PDF converti en image: %s", image_path)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Erreur de conversion PDF vers image: {str(e)}")
+            timings["pdf_to_image"] = time.perf_counter() - t0
+            STAGE_DURATION.labels("pdf_to_image").observe(timings["pdf_to_image"])
+
+        # Conversion Marker déléguée au pool, OCR forcé si pas de couche texte exploitable
+        # (on continue à utiliser le PDF original pour Marker)
+        # Les en-têtes de trace sont transmis aux appels LLM de Marker vers le proxy
+        config = build_marker_config(force_ocr=mode == "ocr", trace=trace_headers(), client_id=x_client_id)
         try:
-            rendered = converter(input_pdf_path)
+            with stage_timer(f"marker_{mode}"):
+                # Pendant un profilage, le worker échantillonne aussi la conversion
+                future = pool.submit(input_pdf_path, config, profile=active_interval())
+                result, worker_timings = future.result(timeout=MARKER_TASK_TIMEOUT)
+        except FutureTimeoutError:
+            # Le PDF est supprimé avec le répertoire temporaire : le worker ne doit pas le traiter
+            pool.cancel(future)
+            raise HTTPException(status_code=504, detail="Marker conversion timed out")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Marker conversion failed: {e}")
-        
-        # Le rendu JSON complet
-        result = rendered.dict()
-        
+        timings.update(worker_timings)
+        STAGE_DURATION.labels("marker_queue_wait").observe(worker_timings["queue_wait"])
+        STAGE_DURATION.labels(f"marker_conversion_{mode}").observe(worker_timings["conversion"])
+
         # Ajout des informations sur l'image générée dans la réponse
         result["image_info"] = {
-            "image_generated": True,
-            "image_filename": os.path.basename(image_path),
-            "image_size_bytes": os.path.getsize(image_path)
+            "image_generated": image_path is not None,
+            "image_filename": os.path.basename(image_path) if image_path else None,
+            "image_size_bytes": os.path.getsize(image_path) if image_path else None,
         }
-        
-        return JSONResponse(content=result)
+
+        timings["total"] = time.perf_counter() - start
+        result["engine"] = engine
+        result["extraction_mode"] = {
+            "requested": ocr_mode,
+            "chosen": mode,
+            "text_layer": text_layer,
+        }
+        result["timings"] = {key: round(value, 3) for key, value in timings.items()}
+        logger.info("Extraction %s terminée : %s", mode, result["timings"])
+
+        response = JSONResponse(content=result)
+        PAYLOAD_SIZE.labels("extraction_response").observe(len(response.body))
+        return response
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,282 @@
+"""
+Profileur par échantillonnage à la demande (endpoint d'administration `/admin/profile`).
+
+Un thread relève périodiquement la pile Python de chaque thread du processus
+(`sys._current_frames`) et, sous Linux, le temps CPU consommé par chaque thread
+depuis le relevé précédent (/proc/self/task/<tid>/stat). On obtient des piles
+agrégées au format « collapsed » (flamegraph.pl, speedscope, inferno) et, par
+fonction, le temps mur et le temps CPU (inclusifs et propres).
+
+Module identique dans api_centrale, api_marker et marker_proxy (chaque service
+est construit dans son propre contexte Docker) : toute modification doit être
+reportée dans les trois copies.
+"""
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+# Jeton requis dans l'en-tête x-admin-token ; endpoint désactivé s'il n'est pas défini
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+PROFILER_DEFAULT_INTERVAL_MS = float(os.getenv("PROFILER_DEFAULT_INTERVAL_MS", "10"))
+
+PROFILE_ROUTE = "/admin/profile"
+# Requêtes techniques (scrapes, sondes) non comptées dans `requests=N`
+IGNORED_PATHS = {PROFILE_ROUTE, "/metrics", "/live", "/ready", "/health"}
+
+try:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = None
+
+
+def thread_cpu_time(native_id: int) -> Optional[float]:
+    """Temps CPU (utilisateur + système) d'un thread du processus, en secondes ; None hors Linux."""
+    if _CLK_TCK is None:
+        return None
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Le nom du thread (2e champ) peut contenir des espaces : on découpe après la parenthèse fermante
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    label = f"{os.path.basename(code.co_filename)}:{name}"
+    return label.replace(";", ":").replace(" ", "_")
+
+
+def _stack(frame) -> List[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class Sampler:
+    """Échantillonneur des piles de tous les threads du processus (sauf le sien et ceux exclus)."""
+
+    def __init__(self, interval: float, exclude: Optional[List[int]] = None):
+        self.interval = interval
+        self.exclude = set(exclude or [])
+        self.stacks: Dict[str, int] = defaultdict(int)
+        # fonction → [temps mur, temps CPU, temps mur propre, temps CPU propre]
+        self.functions: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0])
+        self.samples = 0
+        self.cpu_available = _CLK_TCK is not None
+        self._cpu: Dict[int, float] = {}
+        # Les profils d'autres processus sont fusionnés depuis un autre thread
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(own, now - last)
+            last = now
+
+    def _sample(self, own: int, elapsed: float):
+        threads = {t.ident: t for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own or ident in self.exclude:
+                continue
+            thread = threads.get(ident)
+            name = thread.name if thread is not None else f"thread-{ident}"
+            cpu = 0.0
+            native_id = getattr(thread, "native_id", None)
+            if self.cpu_available and native_id is not None:
+                total = thread_cpu_time(native_id)
+                if total is not None:
+                    cpu = total - self._cpu.get(native_id, total)
+                    self._cpu[native_id] = total
+            self.record([name.replace(" ", "_").replace(";", ":")] + _stack(frame), elapsed, cpu)
+        self.samples += 1
+
+    def record(self, stack: List[str], wall: float, cpu: float):
+        with self._lock:
+            self.stacks[";".join(stack)] += 1
+            for label in set(stack[1:]):
+                stats = self.functions[label]
+                stats[0] += wall
+                stats[1] += cpu
+            if len(stack) > 1:
+                leaf = self.functions[stack[-1]]
+                leaf[2] += wall
+                leaf[3] += cpu
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Données sérialisables, fusionnables avec `merge` (ex. profils des workers)."""
+        return {
+            "stacks": dict(self.stacks),
+            "functions": {name: list(stats) for name, stats in self.functions.items()},
+            "samples": self.samples,
+        }
+
+    def merge(self, data: Dict[str, Any], root: Optional[str] = None):
+        with self._lock:
+            for stack, count in data["stacks"].items():
+                self.stacks[f"{root};{stack}" if root else stack] += count
+            for name, stats in data["functions"].items():
+                mine = self.functions[name]
+                for i, value in enumerate(stats):
+                    mine[i] += value
+
+    def collapsed(self) -> str:
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def function_table(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = sorted(self.functions.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [
+            {
+                "function": name,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4) if self.cpu_available else None,
+                "self_wall_s": round(self_wall, 4),
+                "self_cpu_s": round(self_cpu, 4) if self.cpu_available else None,
+            }
+            for name, (wall, cpu, self_wall, self_cpu) in rows
+        ]
+
+
+class ProfileSession:
+    """Session de profilage : durée fixe, ou jusqu'à la fin des N prochaines requêtes."""
+
+    def __init__(self, interval: float, max_requests: Optional[int], exclude: List[int],
+                 path_prefix: Optional[str] = None):
+        self.sampler = Sampler(interval, exclude)
+        self.max_requests = max_requests
+        self.path_prefix = path_prefix
+        self.requests_done = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def counts(self, path: str) -> bool:
+        """Indique si une requête sur `path` compte parmi les N requêtes profilées."""
+        if path in IGNORED_PATHS:
+            return False
+        return self.path_prefix is None or path.startswith(self.path_prefix)
+
+    def request_done(self):
+        with self._lock:
+            self.requests_done += 1
+            if self.max_requests is not None and self.requests_done >= self.max_requests:
+                self._done.set()
+
+    def run(self, seconds: float):
+        self.sampler.start()
+        self._done.wait(seconds)
+        self.sampler.stop()
+
+
+_session: Optional[ProfileSession] = None
+_session_lock = threading.Lock()
+
+
+def active_interval() -> Optional[float]:
+    """Intervalle d'échantillonnage de la session en cours (à transmettre aux processus fils), sinon None."""
+    session = _session
+    return session.sampler.interval if session is not None else None
+
+
+def merge_remote(data: Optional[Dict[str, Any]], root: str):
+    """Ajoute à la session en cours le profil relevé dans un autre processus (ex. worker Marker)."""
+    session = _session
+    if session is not None and data:
+        session.sampler.merge(data, root)
+
+
+def setup_profiler(app: FastAPI):
+    """Ajoute l'endpoint `/admin/profile` et le décompte des requêtes profilées."""
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        response = await call_next(request)
+        session = _session
+        if session is None or not session.counts(request.url.path):
+            return response
+        body = response.body_iterator
+
+        # La requête n'est comptée qu'à la fin de l'envoi du corps (réponses en streaming)
+        async def counted():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                session.request_done()
+
+        response.body_iterator = counted()
+        return response
+
+    @app.post(PROFILE_ROUTE, include_in_schema=False)
+    def profile(
+        seconds: float = Query(10.0, gt=0, description="Durée du profilage, ou durée maximale avec `requests`"),
+        requests: Optional[int] = Query(None, gt=0, description="Profiler jusqu'à la fin des N prochaines requêtes"),
+        path: Optional[str] = Query(None, description="Ne compter que les requêtes dont le chemin commence ainsi"),
+        interval_ms: float = Query(PROFILER_DEFAULT_INTERVAL_MS, ge=1, description="Intervalle d'échantillonnage"),
+        format: Literal["json", "collapsed"] = "json",
+        x_admin_token: Optional[str] = Header(None),
+    ):
+        global _session
+        if not ADMIN_TOKEN:
+            raise HTTPException(404, "Not Found")
+        if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+            raise HTTPException(403, "Jeton d'administration invalide")
+
+        session = ProfileSession(interval_ms / 1000, requests, exclude=[threading.get_ident()], path_prefix=path)
+        with _session_lock:
+            if _session is not None:
+                raise HTTPException(409, "Un profilage est déjà en cours")
+            _session = session
+        try:
+            session.run(min(seconds, PROFILER_MAX_SECONDS))
+        finally:
+            _session = None
+
+        sampler = session.sampler
+        if format == "collapsed":
+            return PlainTextResponse(
+                sampler.collapsed(),
+                headers={"content-disposition": 'attachment; filename="profile.collapsed"'},
+            )
+        return {
+            "duration": round(sampler.duration, 3),
+            "samples": sampler.samples,
+            "requests": session.requests_done,
+            "interval_ms": interval_ms,
+            "cpu_available": sampler.cpu_available,
+            "functions": sampler.function_table(),
+            "collapsed": sampler.collapsed(),
+        }
@@ -0,0 +1,111 @@
+"""
+Tests du moteur VLM contre le faux serveur LLM (benchmarks/fake_llm.py), appelé en ASGI.
+
+    pip install pytest httpx fastapi PyMuPDF
+    python -m pytest api_marker/tests
+"""
+import asyncio
+import os
+import sys
+
+import fitz  # PyMuPDF
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path[:0] = [os.path.join(ROOT, "api_marker"), os.path.join(ROOT, "benchmarks")]
+
+import fake_llm  # noqa: E402
+import vlm_engine  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fake_settings(monkeypatch):
+    monkeypatch.setattr(fake_llm, "FAKE_LLM_LATENCY", 0.0)
+    monkeypatch.setattr(fake_llm, "FAKE_LLM_JITTER", 0.0)
+    monkeypatch.setattr(vlm_engine, "VLM_BASE_URL", "http://fake-llm/v1")
+    monkeypatch.setattr(vlm_engine, "VLM_DPI", 36)
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = str(tmp_path / "bilan.pdf")
+    with fitz.open() as pdf_document:
+        for _ in range(2):
+            page = pdf_document.new_page()
+            page.insert_text((72, 72), "Bilan actif - Total 9 300", fontsize=12)
+        pdf_document.save(path)
+    return path
+
+
+def run(pdf_path, variant=None, transport=None):
+    headers = {fake_llm.RESPONSE_HEADER: variant} if variant else None
+    transport = transport or httpx.ASGITransport(app=fake_llm.app)
+    return asyncio.run(vlm_engine.extract_tables(pdf_path, headers=headers, transport=transport))
+
+
+def pages(document):
+    return document["children"]
+
+
+@pytest.mark.parametrize("variant", [None, "fenced", "wrapped"])
+def test_extract_tables_parses_json_responses(pdf_path, variant):
+    document = run(pdf_path, variant)
+    assert document["block_type"] == "Document"
+    assert len(pages(document)) == 2
+    for page in pages(document):
+        assert page["error"] is None
+        (table,) = page["children"]
+        assert table["block_type"] == "Table"
+        assert table["title"] == "Bilan actif"
+        assert table["rows"][-1] == ["Total actif", "11 700", "2 400", "9 300", "9 430"]
+        assert "<td>Total actif</td>" in table["html"]
+    assert document["timings"]["vlm_page_max"] >= 0
+
+
+@pytest.mark.parametrize("variant, error", [
+    ("invalid", "Invalid VLM output"),
+    ("no_choices", "Invalid VLM response"),
+    ("error", "VLM error 500"),
+])
+def test_extract_tables_reports_errors_per_page(pdf_path, variant, error):
+    document = run(pdf_path, variant)
+    for page in pages(document):
+        assert page["children"] == []
+        assert page["error"].startswith(error)
+
+
+def test_extract_tables_survives_transport_errors(pdf_path):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectTimeout("timed out", request=request)
+        return await httpx.ASGITransport(app=fake_llm.app).handle_async_request(request)
+
+    document = run(pdf_path, transport=httpx.MockTransport(handler))
+    errors = [page["error"] for page in pages(document)]
+    assert sum(e is not None and e.startswith("VLM request failed") for e in errors) == 1
+    assert sum(e is None for e in errors) == 1
+
+
+def test_parse_tables_normalises_cells():
+    content = 'Résultat : {"tables": [{"title": null, "header": ["A", 1], "rows": [[2, "x"]]}, "bruit"]}'
+    assert vlm_engine.parse_tables(content) == [{"title": "", "header": ["A", "1"], "rows": [["2", "x"]]}]
+
+
+def test_parse_tables_rejects_text_without_json():
+    with pytest.raises(ValueError):
+        vlm_engine.parse_tables("Aucun tableau sur cette page.")
+
+
+@pytest.mark.parametrize("content", [
+    '{"tables": 5}',
+    '{"tables": [{"header": 3}]}',
+    '{"tables": [{"rows": [1]}]}',
+    '{"tables": [{"rows": "A;B"}]}',
+])
+def test_parse_tables_rejects_unexpected_shapes(content):
+    with pytest.raises(ValueError):
+        vlm_engine.parse_tables(content)
@@ -0,0 +1,118 @@
+import os
+import unicodedata
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+
+# Seuils de décision (surchargés par variables d'environnement)
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+TEXT_LAYER_MIN_COVERAGE = float(os.getenv("TEXT_LAYER_MIN_COVERAGE", "0.03"))
+TEXT_LAYER_MIN_QUALITY = float(os.getenv("TEXT_LAYER_MIN_QUALITY", "0.95"))
+# Au-delà de cette part de la page couverte par une image, on considère
+# la page comme un scan (le texte éventuel est une couche OCR invisible)
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.6"))
+
+OCR_MODES = ("auto", "ocr", "native")
+
+
+def _is_valid_glyph(char: str) -> bool:
+    """Un glyphe est valide s'il est correctement mappé vers un caractère Unicode imprimable."""
+    if char == "�":
+        return False
+    category = unicodedata.category(char)
+    # Cc/Cf : caractères de contrôle, Co : zone à usage privé, Cn : non assigné
+    return category not in ("Cc", "Cf", "Co", "Cn")
+
+
+def _rect_area(bbox) -> float:
+    rect = fitz.Rect(bbox)
+    return max(rect.width, 0) * max(rect.height, 0)
+
+
+def analyse_page(page: fitz.Page) -> Dict[str, Any]:
+    """
+    Mesure la couverture et la qualité de la couche texte d'une page.
+
+    Args:
+        page (fitz.Page): Page PyMuPDF à analyser
+
+    Returns:
+        dict: Statistiques de la page (nombre de caractères, couverture texte,
+        couverture image, qualité des glyphes) et décision `has_text_layer`
+    """
+    page_area = _rect_area(page.rect) or 1.0
+    text_area = 0.0
+    n_chars = 0
+    n_valid = 0
+
+    raw = page.get_text("rawdict", flags=fitz.TEXT_PRESERVE_WHITESPACE)
+    for block in raw.get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                chars = [c["c"] for c in span.get("chars", []) if not c["c"].isspace()]
+                if not chars:
+                    continue
+                text_area += _rect_area(span["bbox"])
+                n_chars += len(chars)
+                n_valid += sum(1 for c in chars if _is_valid_glyph(c))
+
+    image_area = 0.0
+    for info in page.get_image_info():
+        image_area += _rect_area(fitz.Rect(info["bbox"]) & page.rect)
+
+    coverage = min(text_area / page_area, 1.0)
+    image_coverage = min(image_area / page_area, 1.0)
+    quality = n_valid / n_chars if n_chars else 0.0
+
+    has_text_layer = (
+        n_chars >= TEXT_LAYER_MIN_CHARS
+        and coverage >= TEXT_LAYER_MIN_COVERAGE
+        and quality >= TEXT_LAYER_MIN_QUALITY
+        and image_coverage <= TEXT_LAYER_MAX_IMAGE_COVERAGE
+    )
+
+    return {
+        "page": page.number,
+        "chars": n_chars,
+        "text_coverage": round(coverage, 4),
+        "image_coverage": round(image_coverage, 4),
+        "glyph_quality": round(quality, 4),
+        "has_text_layer": has_text_layer,
+    }
+
+
+def analyse_text_layer(pdf_path: str) -> List[Dict[str, Any]]:
+    """
+    Analyse la couche texte de chaque page d'un PDF.
+
+    Args:
+        pdf_path (str): Chemin vers le fichier PDF
+
+    Returns:
+        list: Statistiques par page (voir `analyse_page`)
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return [analyse_page(page) for page in pdf_document]
+
+
+def choose_extraction_mode(pages: List[Dict[str, Any]], requested: str = "auto") -> str:
+    """
+    Choisit entre OCR forcé et extraction native du texte.
+
+    Args:
+        pages (list): Statistiques par page issues de `analyse_text_layer`
+        requested (str): Mode demandé ("auto", "ocr" ou "native")
+
+    Returns:
+        str: Mode retenu, "ocr" ou "native"
+    """
+    if requested not in OCR_MODES:
+        raise ValueError(f"Mode inconnu '{requested}'. Valeurs possibles : {', '.join(OCR_MODES)}")
+    if requested != "auto":
+        return requested
+    # Une seule page sans couche texte exploitable suffit à forcer l'OCR
+    if pages and all(p["has_text_layer"] for p in pages):
+        return "native"
+    return "ocr"
@@ -0,0 +1,35 @@
+from typing import Annotated, Dict, Optional
+
+import openai
+from marker.services.openai import OpenAIService
+
+
+class TracedOpenAIService(OpenAIService):
+    """Service OpenAI de Marker qui transmet le contexte de trace de la requête au proxy LLM."""
+
+    openai_traceparent: Annotated[
+        Optional[str],
+        "En-tête W3C traceparent à transmettre au LLM."
+    ] = None
+    openai_request_id: Annotated[
+        Optional[str],
+        "Identifiant de requête (x-request-id) à transmettre au LLM."
+    ] = None
+    openai_client_id: Annotated[
+        Optional[str],
+        "Identifiant du client (x-client-id) pour les budgets de tokens du proxy LLM."
+    ] = None
+
+    def get_client(self) -> openai.OpenAI:
+        headers: Dict[str, str] = {}
+        if self.openai_traceparent:
+            headers["traceparent"] = self.openai_traceparent
+        if self.openai_request_id:
+            headers["x-request-id"] = self.openai_request_id
+        if self.openai_client_id:
+            headers["x-client-id"] = self.openai_client_id
+        return openai.OpenAI(
+            api_key=self.openai_api_key,
+            base_url=self.openai_base_url,
+            default_headers=headers or None,
+        )
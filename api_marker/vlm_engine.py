@@ -0,0 +1,219 @@
+import asyncio
+import base64
+import html
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import fitz  # PyMuPDF
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Configuration du VLM (API compatible OpenAI, par défaut derrière le proxy)
+VLM_BASE_URL = os.getenv("VLM_BASE_URL") or os.getenv("PROXY_URL")
+VLM_MODEL = os.getenv("VLM_MODEL", "gemma3:27b")
+VLM_API_KEY = os.getenv("VLM_API_KEY") or os.getenv("REAL_LLM_API_KEY")
+# Nombre de pages envoyées simultanément au VLM
+VLM_CONCURRENCY = int(os.getenv("VLM_CONCURRENCY", "8"))
+VLM_DPI = int(os.getenv("VLM_DPI", "150"))
+VLM_TIMEOUT = float(os.getenv("VLM_TIMEOUT", "300"))
+
+TABLE_PROMPT = """Tu es un outil d'extraction de tableaux financiers (comptes sociaux français).
+Extrais TOUS les tableaux présents sur l'image de la page.
+Réponds uniquement avec un objet JSON, sans texte autour, au format :
+{"tables": [{"title": "<titre du tableau ou chaîne vide>",
+             "header": ["<en-tête colonne 1>", "<en-tête colonne 2>", ...],
+             "rows": [["<cellule>", "<cellule>", ...], ...]}]}
+Recopie les libellés et les montants exactement tels qu'ils apparaissent (sans reformater les nombres).
+Une cellule vide est une chaîne vide. S'il n'y a aucun tableau, réponds {"tables": []}."""
+
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+def render_pages(pdf_path: str, dpi: int = VLM_DPI) -> List[bytes]:
+    """
+    Convertit chaque page d'un PDF en image PNG.
+
+    Args:
+        pdf_path (str): Chemin vers le fichier PDF
+        dpi (int): Résolution des images
+
+    Returns:
+        list: Images PNG (bytes), une par page
+    """
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    with fitz.open(pdf_path) as pdf_document:
+        return [page.get_pixmap(matrix=mat).tobytes("png") for page in pdf_document]
+
+
+def _as_list(value: Any, field: str) -> list:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"`{field}` doit être une liste, pas {type(value).__name__}")
+    return value
+
+
+def parse_tables(content: str) -> List[Dict[str, Any]]:
+    """
+    Extrait la liste des tableaux de la réponse du VLM (JSON éventuellement entouré de texte).
+
+    Lève ValueError si la réponse ne contient pas de JSON ou si sa structure est inattendue.
+    """
+    match = _JSON_FENCE.search(content)
+    if match:
+        content = match.group(1)
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError("Aucun objet JSON dans la réponse du VLM")
+    data = json.loads(content[start:end + 1])
+    tables = _as_list(data.get("tables"), "tables") if isinstance(data, dict) else []
+    return [
+        {
+            "title": str(t.get("title") or ""),
+            "header": [str(c) for c in _as_list(t.get("header"), "header")],
+            "rows": [[str(c) for c in _as_list(row, "rows[]")] for row in _as_list(t.get("rows"), "rows")],
+        }
+        for t in tables
+        if isinstance(t, dict)
+    ]
+
+
+def table_to_html(table: Dict[str, Any]) -> str:
+    """Rendu HTML d'un tableau, au format des blocs `Table` de Marker."""
+    parts = ["<table>"]
+    if table["header"]:
+        cells = "".join(f"<th>{html.escape(c)}</th>" for c in table["header"])
+        parts.append(f"<thead><tr>{cells}</tr></thead>")
+    parts.append("<tbody>")
+    for row in table["rows"]:
+        cells = "".join(f"<td>{html.escape(c)}</td>" for c in row)
+        parts.append(f"<tr>{cells}</tr>")
+    parts.append("</tbody></table>")
+    return "".join(parts)
+
+
+def to_marker_document(pages: List[Dict[str, Any]], page_sizes: List[List[float]]) -> Dict[str, Any]:
+    """Assemble les tableaux extraits dans le schéma JSON produit par Marker (Document > Page > Table)."""
+    children = []
+    for page_index, (page, size) in enumerate(zip(pages, page_sizes)):
+        bbox = [0.0, 0.0, size[0], size[1]]
+        polygon = [[0.0, 0.0], [size[0], 0.0], [size[0], size[1]], [0.0, size[1]]]
+        blocks = [
+            {
+                "id": f"/page/{page_index}/Table/{table_index}",
+                "block_type": "Table",
+                "html": table_to_html(table),
+                "polygon": polygon,
+                "bbox": bbox,
+                "children": None,
+                "section_hierarchy": {},
+                "images": {},
+                "title": table["title"],
+                "header": table["header"],
+                "rows": table["rows"],
+            }
+            for table_index, table in enumerate(page["tables"])
+        ]
+        children.append({
+            "id": f"/page/{page_index}/Page/0",
+            "block_type": "Page",
+            "html": "".join(b["html"] for b in blocks),
+            "polygon": polygon,
+            "bbox": bbox,
+            "children": blocks,
+            "section_hierarchy": {},
+            "images": {},
+            "error": page.get("error"),
+        })
+    return {
+        "children": children,
+        "block_type": "Document",
+        "metadata": {"engine": "vlm", "model": VLM_MODEL},
+    }
+
+
+async def _extract_page(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, image: bytes,
+                        headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    data_url = f"data:image/png;base64,{base64.b64encode(image).decode('utf-8')}"
+    payload = {
+        "model": VLM_MODEL,
+        "temperature": 0,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": TABLE_PROMPT},
+                {"type": "image_url", "image_url": {"url": data_url}},
+            ],
+        }],
+    }
+    async with semaphore:
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post("chat/completions", json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            # Erreur réseau ou délai dépassé : seule cette page est en erreur
+            logger.error("VLM request failed: %s", e)
+            return {"tables": [], "latency": time.perf_counter() - t0,
+                    "error": f"VLM request failed: {type(e).__name__}: {e}"}
+        latency = time.perf_counter() - t0
+    if resp.status_code != 200:
+        logger.error("VLM error %s: %s", resp.status_code, resp.text)
+        return {"tables": [], "latency": latency, "error": f"VLM error {resp.status_code}"}
+    try:
+        content = resp.json()["choices"][0]["message"]["content"]
+        if not isinstance(content, str):
+            raise TypeError(f"contenu de type {type(content).__name__}")
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        logger.error("Réponse VLM sans contenu : %s", e)
+        return {"tables": [], "latency": latency, "error": f"Invalid VLM response: {e}"}
+    try:
+        tables = parse_tables(content)
+    except (ValueError, json.JSONDecodeError) as e:
+        logger.error("Réponse VLM illisible : %s", e)
+        return {"tables": [], "latency": latency, "error": f"Invalid VLM output: {e}"}
+    return {"tables": tables, "latency": latency, "error": None}
+
+
+async def extract_tables(pdf_path: str, headers: Optional[Dict[str, str]] = None,
+                         transport: Optional[httpx.AsyncBaseTransport] = None) -> Dict[str, Any]:
+    """
+    Extrait les tableaux de toutes les pages d'un PDF en interrogeant directement un VLM.
+
+    Les pages sont envoyées en parallèle (au plus `VLM_CONCURRENCY` requêtes simultanées).
+
+    Args:
+        pdf_path (str): Chemin vers le fichier PDF
+        headers (dict): En-têtes HTTP supplémentaires à transmettre au VLM
+        transport (httpx.AsyncBaseTransport): Transport HTTP (tests contre un faux serveur en ASGI)
+
+    Returns:
+        dict: Document au schéma JSON de Marker, avec les temps de traitement dans `timings`
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    images = render_pages(pdf_path)
+    with fitz.open(pdf_path) as pdf_document:
+        page_sizes = [[page.rect.width, page.rect.height] for page in pdf_document]
+    timings["render"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    semaphore = asyncio.Semaphore(VLM_CONCURRENCY)
+    client_headers = {"Authorization": f"Bearer {VLM_API_KEY}"} if VLM_API_KEY else {}
+    base_url = VLM_BASE_URL.rstrip("/") + "/"
+    async with httpx.AsyncClient(base_url=base_url, headers=client_headers, timeout=VLM_TIMEOUT,
+                                 transport=transport) as client:
+        pages = await asyncio.gather(*(_extract_page(client, semaphore, image, headers) for image in images))
+    timings["vlm"] = time.perf_counter() - t0
+
+    latencies = [p["latency"] for p in pages]
+    timings["vlm_page_mean"] = sum(latencies) / len(latencies) if latencies else 0.0
+    timings["vlm_page_max"] = max(latencies, default=0.0)
+
+    document = to_marker_document(pages, page_sizes)
+    document["timings"] = timings
+    return document
@@ -0,0 +1,334 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from profiler import Sampler, merge_remote
+
+logger = logging.getLogger(__name__)
+
+# Configuration du pool (variables d'environnement)
+MARKER_WORKERS = int(os.getenv("MARKER_WORKERS", "1"))
+# 0 : autant de threads torch que de cœurs attribués au worker
+MARKER_TORCH_THREADS = int(os.getenv("MARKER_TORCH_THREADS", "0"))
+MARKER_CPU_PINNING = os.getenv("MARKER_CPU_PINNING", "1") == "1"
+# Conversion d'une page de test au démarrage pour initialiser les modèles avant le premier appel
+MARKER_WARMUP = os.getenv("MARKER_WARMUP", "1") == "1"
+# Intervalle de vérification des workers (arrêts brutaux), indépendant de l'activité de la file
+MARKER_WORKER_CHECK_INTERVAL = float(os.getenv("MARKER_WORKER_CHECK_INTERVAL", "1"))
+
+# Indicateurs d'annulation partagés avec les workers, indexés par task_id modulo la taille
+_CANCEL_SLOTS = 65536
+
+
+def build_marker_config(force_ocr: bool, use_llm: bool = True,
+                        trace: Optional[Dict[str, str]] = None,
+                        client_id: Optional[str] = None) -> Dict[str, Any]:
+    """Configuration Marker pour produire du JSON, avec ou sans OCR forcé.
+
+    `trace` contient les en-têtes traceparent/x-request-id transmis aux appels LLM,
+    `client_id` l'identifiant du client pour les budgets de tokens du proxy.
+    """
+    trace = trace or {}
+    return {
+        "output_format": "json",
+        "force_ocr": force_ocr,
+        "use_llm": use_llm,
+        "llm_service": "traced_openai_service.TracedOpenAIService",
+        "openai_base_url": os.getenv("PROXY_URL"),
+        "openai_model": "gemma3:27b",
+        "openai_api_key": os.getenv("REAL_LLM_API_KEY"),
+        "openai_traceparent": trace.get("traceparent"),
+        "openai_request_id": trace.get("x-request-id"),
+        "openai_client_id": client_id,
+        "timeout": 99999,
+    }
+
+
+def split_cores(n_workers: int) -> List[List[int]]:
+    """Répartit les cœurs disponibles en `n_workers` sous-ensembles contigus."""
+    cores = sorted(os.sched_getaffinity(0))
+    if n_workers == 0:
+        return []
+    if n_workers > len(cores):
+        # Plus de workers que de cœurs : on partage les cœurs en round-robin
+        return [[cores[i % len(cores)]] for i in range(n_workers)]
+    size, extra = divmod(len(cores), n_workers)
+    subsets, start = [], 0
+    for i in range(n_workers):
+        end = start + size + (1 if i < extra else 0)
+        subsets.append(cores[start:end])
+        start = end
+    return subsets
+
+
+def _warmup(models, tmpdir):
+    """Convertit une page générée (sans LLM) pour déclencher les initialisations paresseuses."""
+    import fitz  # PyMuPDF
+    from marker.converters.pdf import PdfConverter
+    from marker.config.parser import ConfigParser
+
+    pdf_path = os.path.join(tmpdir, "warmup.pdf")
+    with fitz.open() as pdf_document:
+        page = pdf_document.new_page()
+        page.insert_text((72, 72), "Bilan actif - Total 1 000", fontsize=12)
+        pdf_document.save(pdf_path)
+    parser = ConfigParser(build_marker_config(force_ocr=True, use_llm=False))
+    converter = PdfConverter(
+        config=parser.generate_config_dict(),
+        artifact_dict=models,
+        processor_list=parser.get_processors(),
+        renderer=parser.get_renderer(),
+    )
+    converter(pdf_path)
+
+
+def _worker_main(worker_id, cores, torch_threads, task_queue, result_queue, cancelled, warmup=False):
+    """Boucle d'un worker : charge les modèles une fois puis traite les tâches de la file."""
+    # Les variables OpenMP/MKL doivent être fixées avant l'import de torch
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(torch_threads)
+    if cores:
+        os.sched_setaffinity(0, cores)
+
+    phases = {}
+    t0 = time.perf_counter()
+    import torch
+    from marker.converters.pdf import PdfConverter
+    from marker.models import create_model_dict
+    from marker.config.parser import ConfigParser
+    phases["imports"] = time.perf_counter() - t0
+
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+
+    # Les poids sont lus depuis le cache local (MODEL_CACHE_DIR / HF_HOME), en mmap pour les safetensors
+    t0 = time.perf_counter()
+    models = create_model_dict()
+    phases["model_load"] = time.perf_counter() - t0
+
+    if warmup:
+        import tempfile
+        t0 = time.perf_counter()
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                _warmup(models, tmpdir)
+        except Exception as e:
+            # Un échec de warm-up ne doit pas empêcher le worker de servir
+            logger.warning("Warm-up du worker %s échoué : %s", worker_id, e)
+        phases["warmup"] = time.perf_counter() - t0
+
+    result_queue.put(("ready", worker_id, phases))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id = task["task_id"]
+        if cancelled[task_id % _CANCEL_SLOTS]:
+            # Tâche abandonnée par l'API (délai dépassé) : son PDF a déjà été supprimé
+            result_queue.put(("cancelled", worker_id, task_id, None))
+            continue
+        started = time.time()
+        result_queue.put(("start", worker_id, task_id, started))
+        sampler = None
+        if task.get("profile"):
+            sampler = Sampler(task["profile"])
+            sampler.start()
+        try:
+            parser = ConfigParser(task["config"])
+            converter = PdfConverter(
+                config=parser.generate_config_dict(),
+                artifact_dict=models,
+                processor_list=parser.get_processors(),
+                renderer=parser.get_renderer(),
+                llm_service=parser.get_llm_service()
+            )
+            rendered = converter(task["pdf_path"])
+            timings = {
+                "queue_wait": started - task["submitted_at"],
+                "conversion": time.time() - started,
+            }
+            message = ("done", worker_id, task_id, rendered.dict(), timings)
+        except Exception as e:
+            message = ("error", worker_id, task_id, f"{type(e).__name__}: {e}")
+        profile = None
+        if sampler is not None:
+            sampler.stop()
+            profile = sampler.snapshot()
+        result_queue.put(message + (profile,))
+
+
+class WorkerCrashedError(RuntimeError):
+    """Le worker Marker qui traitait la tâche s'est arrêté brutalement."""
+
+
+class MarkerWorkerPool:
+    """
+    Pool de processus Marker, chacun avec ses propres modèles chargés.
+
+    Les tâches sont déposées dans une file partagée ; chaque worker est épinglé
+    sur un sous-ensemble de cœurs et utilise un nombre de threads torch réglé.
+    Avec `n_workers=0`, aucun modèle Marker n'est chargé (pods dédiés au moteur VLM).
+    """
+
+    def __init__(self, n_workers: int = MARKER_WORKERS, torch_threads: int = MARKER_TORCH_THREADS,
+                 cpu_pinning: bool = MARKER_CPU_PINNING, warmup: bool = MARKER_WARMUP):
+        self.n_workers = max(0, n_workers)
+        self.cpu_pinning = cpu_pinning
+        self.warmup = warmup
+        self.core_subsets = split_cores(self.n_workers)
+        self.torch_threads = torch_threads
+        self._ctx = mp.get_context("spawn")
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._cancelled = self._ctx.RawArray("b", _CANCEL_SLOTS)
+        self._processes: Dict[int, Any] = {}
+        self._futures: Dict[int, Future] = {}
+        self._running: Dict[int, Optional[int]] = {}
+        self._ready = set()
+        self.startup_phases: Dict[int, Dict[str, float]] = {}
+        self._started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._collector: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def _spawn(self, worker_id: int):
+        cores = self.core_subsets[worker_id] if self.cpu_pinning else None
+        threads = self.torch_threads or len(self.core_subsets[worker_id])
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, cores, threads, self._task_queue, self._result_queue, self._cancelled, self.warmup),
+            name=f"marker-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+        self._running[worker_id] = None
+        logger.info("Worker Marker %s démarré (cœurs=%s, threads torch=%s)", worker_id, cores, threads)
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+        self._collector = threading.Thread(target=self._collect, name="marker-pool-collector", daemon=True)
+        self._collector.start()
+
+    @property
+    def ready_workers(self) -> int:
+        return len(self._ready)
+
+    @property
+    def alive(self) -> bool:
+        """Le collecteur tourne (les workers morts sont relancés par lui)."""
+        return self._collector is not None and self._collector.is_alive()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Attend que tous les workers aient chargé leurs modèles."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.ready_workers < self.n_workers:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    def submit(self, pdf_path: str, config: Dict[str, Any], profile: Optional[float] = None) -> Future:
+        """Dépose une conversion dans la file et renvoie un Future résolu par le collecteur.
+
+        Avec `profile` (intervalle en secondes), le worker échantillonne ses piles
+        pendant la conversion ; le profil est fusionné dans la session de profilage en cours.
+        """
+        future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            self._futures[task_id] = future
+        self._cancelled[task_id % _CANCEL_SLOTS] = 0
+        self._task_queue.put({
+            "task_id": task_id,
+            "pdf_path": pdf_path,
+            "config": config,
+            "submitted_at": time.time(),
+            "profile": profile,
+        })
+        return future
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Abandonne une tâche dont le résultat ne sera pas lu (ex. délai dépassé).
+
+        Une tâche encore en file est ignorée par le worker ; une conversion déjà
+        commencée va à son terme mais son résultat est écarté.
+        """
+        with self._lock:
+            task_id = next((tid for tid, f in self._futures.items() if f is future), None)
+            if task_id is None:
+                return False
+            del self._futures[task_id]
+        self._cancelled[task_id % _CANCEL_SLOTS] = 1
+        future.cancel()
+        return True
+
+    def _collect(self):
+        """Résout les Futures à partir des messages des workers et relance les workers morts."""
+        last_check = time.monotonic()
+        while not self._stopping:
+            # Vérification périodique, même quand les messages arrivent sans interruption
+            if time.monotonic() - last_check >= MARKER_WORKER_CHECK_INTERVAL:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                message = self._result_queue.get(timeout=MARKER_WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            kind, worker_id = message[0], message[1]
+            if kind == "ready":
+                self._ready.add(worker_id)
+                phases = {key: round(value, 2) for key, value in message[2].items()}
+                self.startup_phases[worker_id] = phases
+                logger.info("Worker Marker %s prêt, phases de démarrage (s) : %s", worker_id, phases)
+                if self.ready_workers == self.n_workers:
+                    logger.info("Pool Marker prêt en %.1fs", time.perf_counter() - self._started_at)
+            elif kind == "start":
+                self._running[worker_id] = message[2]
+            elif kind == "cancelled":
+                logger.info("Tâche %s annulée, ignorée par le worker %s", message[2], worker_id)
+            elif kind in ("done", "error"):
+                self._running[worker_id] = None
+                merge_remote(message[-1], f"marker-worker-{worker_id}")
+                with self._lock:
+                    future = self._futures.pop(message[2], None)
+                if future is None:
+                    continue
+                if kind == "done":
+                    future.set_result((message[3], message[4]))
+                else:
+                    future.set_exception(RuntimeError(message[3]))
+
+    def _check_workers(self):
+        for worker_id, process in list(self._processes.items()):
+            if process.is_alive() or self._stopping:
+                continue
+            logger.error("Worker Marker %s arrêté (code %s), redémarrage", worker_id, process.exitcode)
+            self._ready.discard(worker_id)
+            task_id = self._running.get(worker_id)
+            if task_id is not None:
+                with self._lock:
+                    future = self._futures.pop(task_id, None)
+                if future is not None:
+                    future.set_exception(WorkerCrashedError(f"Worker {worker_id} arrêté (code {process.exitcode})"))
+            self._spawn(worker_id)
+
+    def shutdown(self, timeout: float = 10):
+        self._stopping = True
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
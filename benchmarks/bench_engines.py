@@ -0,0 +1,92 @@
+"""
+Compare les moteurs d'extraction d'api_marker (pipeline Marker / VLM direct) en débit et latence.
+
+Exemple, avec le faux LLM (fake_llm.py) derrière PROXY_URL :
+    python bench_engines.py --url http://localhost:8001/extract --pdf page.pdf \\
+        --engines marker,vlm --requests 20 --concurrency 4 --output bench_engines.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, q):
+    """Percentile `q` (0-100) par interpolation linéaire."""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    low, high = int(k), min(int(k) + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+async def run_engine(url, pdfs, engine, n_requests, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, pages, errors = [], 0, 0
+
+    async def one(client, path, content):
+        nonlocal pages, errors
+        async with semaphore:
+            t0 = time.perf_counter()
+            files = {"pdf": (os.path.basename(path), content, "application/pdf")}
+            try:
+                resp = await client.post(url, files=files, data={"engine": engine})
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latency = time.perf_counter() - t0
+        if resp.status_code != 200:
+            errors += 1
+            return
+        latencies.append(latency)
+        pages += len(resp.json().get("children", []))
+
+    contents = [(path, open(path, "rb").read()) for path in pdfs]
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, *contents[i % len(contents)]) for i in range(n_requests)))
+        elapsed = time.perf_counter() - t0
+
+    return {
+        "engine": engine,
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 3),
+        "pages_per_min": round(60 * pages / elapsed, 2),
+        "latency_mean_s": round(statistics.mean(latencies), 3) if latencies else None,
+        "latency_p50_s": round(percentile(latencies, 50), 3) if latencies else None,
+        "latency_p95_s": round(percentile(latencies, 95), 3) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des moteurs d'extraction d'api_marker")
+    parser.add_argument("--url", default="http://localhost:8001/extract")
+    parser.add_argument("--pdf", nargs="+", required=True, help="PDF d'exemple")
+    parser.add_argument("--engines", default="marker,vlm")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--output", help="Fichier JSON de résultats")
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines.split(","):
+        result = asyncio.run(run_engine(args.url, args.pdf, engine, args.requests, args.concurrency, args.timeout))
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare deux résultats de run_e2e.py et signale les régressions.
+
+    python compare.py results/main.json results/branche.json --tolerance 0.10
+
+Code de sortie 1 si une métrique se dégrade au-delà de la tolérance.
+"""
+import argparse
+import json
+import sys
+
+# (chemin dans le JSON, sens : +1 si une hausse est une dégradation, -1 sinon)
+METRICS = [
+    (("load", "latency_s", "p50"), 1),
+    (("load", "latency_s", "p95"), 1),
+    (("load", "latency_s", "p99"), 1),
+    (("load", "requests_per_s"), -1),
+    (("load", "errors"), 1),
+]
+
+
+def _get(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare(baseline: dict, candidate: dict, tolerance: float) -> list:
+    metrics = list(METRICS)
+    for service in sorted(set(baseline.get("peak_rss_bytes", {})) | set(candidate.get("peak_rss_bytes", {}))):
+        metrics.append((("peak_rss_bytes", service), 1))
+
+    rows = []
+    for path, direction in metrics:
+        before, after = _get(baseline, path), _get(candidate, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+        rows.append({
+            "metric": ".".join(path),
+            "baseline": before,
+            "candidate": after,
+            "change": change,
+            "regression": direction * change > tolerance,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparaison de deux runs de benchmark")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Dégradation relative tolérée")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.tolerance)
+    print(f"{'métrique':<35} {'référence':>14} {'candidat':>14} {'écart':>8}")
+    for row in rows:
+        flag = "  RÉGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<35} {row['baseline']:>14} {row['candidate']:>14} {row['change']:>+8.1%}{flag}")
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
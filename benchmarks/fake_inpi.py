@@ -0,0 +1,56 @@
+"""
+Faux serveur INPI (login, liste des actes, téléchargement) servant des PDF d'exemple.
+
+    FAKE_INPI_PDF_DIR=samples/ uvicorn fake_inpi:app --port 9001
+"""
+import asyncio
+import os
+import zlib
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+
+from samples import ensure_samples
+
+FAKE_INPI_PDF_DIR = os.getenv("FAKE_INPI_PDF_DIR", "samples")
+# Latences simulées (secondes) pour chaque endpoint
+FAKE_INPI_LOGIN_LATENCY = float(os.getenv("FAKE_INPI_LOGIN_LATENCY", "0.2"))
+FAKE_INPI_ATTACHMENTS_LATENCY = float(os.getenv("FAKE_INPI_ATTACHMENTS_LATENCY", "0.3"))
+FAKE_INPI_DOWNLOAD_LATENCY = float(os.getenv("FAKE_INPI_DOWNLOAD_LATENCY", "0.5"))
+FAKE_INPI_YEARS = [str(y) for y in range(2016, 2025)]
+
+app = FastAPI(title="Fake INPI", version="1.0.0")
+PDFS = [open(path, "rb").read() for path in ensure_samples(FAKE_INPI_PDF_DIR)]
+
+
+def _check_token(request: Request):
+    if request.headers.get("authorization") != "Bearer fake-token":
+        raise HTTPException(401, "Invalid token")
+
+
+@app.post("/api/sso/login")
+async def login():
+    await asyncio.sleep(FAKE_INPI_LOGIN_LATENCY)
+    return {"token": "fake-token"}
+
+
+@app.get("/api/companies/{siren}/attachments")
+async def attachments(siren: str, request: Request):
+    _check_token(request)
+    await asyncio.sleep(FAKE_INPI_ATTACHMENTS_LATENCY)
+    return {
+        "bilans": [
+            {"id": f"{siren}-{year}", "dateDepot": f"{year}-06-30", "typeBilan": "C"}
+            for year in FAKE_INPI_YEARS
+        ],
+        "actes": [],
+    }
+
+
+@app.get("/api/bilans/{identifier}/download")
+async def download(identifier: str, request: Request):
+    _check_token(request)
+    await asyncio.sleep(FAKE_INPI_DOWNLOAD_LATENCY)
+    # Même identifiant → même PDF, pour des runs reproductibles
+    pdf = PDFS[zlib.crc32(identifier.encode()) % len(PDFS)]
+    return Response(content=pdf, media_type="application/pdf")
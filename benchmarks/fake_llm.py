@@ -0,0 +1,117 @@
+"""
+Faux serveur LLM compatible OpenAI, pour les tests et benchmarks sans le LLM partagé.
+
+Renvoie toujours le même tableau au format attendu par le moteur VLM d'api_marker,
+en une fois ou en streaming (`"stream": true`, format SSE OpenAI).
+L'en-tête `x-fake-llm-response` choisit une réponse dégradée pour les tests
+(`fenced`, `wrapped`, `invalid`, `no_choices`, `error`).
+
+    FAKE_LLM_LATENCY=2 FAKE_LLM_TOKENS_PER_S=50 uvicorn fake_llm:app --port 9000
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Latence simulée (secondes) et variation aléatoire autour de cette latence
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "1.0"))
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.2"))
+FAKE_LLM_MODEL = os.getenv("FAKE_LLM_MODEL", "gemma3:27b")
+# Débit simulé en streaming (fragments par seconde, après le premier fragment)
+FAKE_LLM_TOKENS_PER_S = float(os.getenv("FAKE_LLM_TOKENS_PER_S", "100"))
+FAKE_LLM_CHUNK_CHARS = int(os.getenv("FAKE_LLM_CHUNK_CHARS", "4"))
+
+FAKE_TABLE = {
+    "tables": [{
+        "title": "Bilan actif",
+        "header": ["", "Brut", "Amortissements", "Net N", "Net N-1"],
+        "rows": [
+            ["Immobilisations incorporelles", "1 250", "300", "950", "1 010"],
+            ["Immobilisations corporelles", "8 400", "2 100", "6 300", "6 550"],
+            ["Stocks", "2 050", "", "2 050", "1 870"],
+            ["Total actif", "11 700", "2 400", "9 300", "9 430"],
+        ],
+    }]
+}
+
+RESPONSE_HEADER = "x-fake-llm-response"
+
+app = FastAPI(title="Fake LLM", version="1.0.0")
+
+
+def _latency() -> float:
+    return max(0.0, random.uniform(FAKE_LLM_LATENCY - FAKE_LLM_JITTER, FAKE_LLM_LATENCY + FAKE_LLM_JITTER))
+
+
+def _usage(content: str) -> dict:
+    completion_tokens = max(1, len(content) // FAKE_LLM_CHUNK_CHARS)
+    return {"prompt_tokens": 1000, "completion_tokens": completion_tokens, "total_tokens": 1000 + completion_tokens}
+
+
+async def _stream(model: str, content: str):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    await asyncio.sleep(_latency())
+    for i in range(0, len(content), FAKE_LLM_CHUNK_CHARS):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content[i:i + FAKE_LLM_CHUNK_CHARS]}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(1 / FAKE_LLM_TOKENS_PER_S)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": _usage(content),
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    request_data = await request.json()
+    model = request_data.get("model", FAKE_LLM_MODEL)
+    variant = request.headers.get(RESPONSE_HEADER, "json")
+    content = json.dumps(FAKE_TABLE, ensure_ascii=False)
+    if variant == "fenced":
+        content = f"```json\n{content}\n```"
+    elif variant == "wrapped":
+        content = f"Voici les tableaux extraits :\n{content}\nBonne journée."
+    elif variant == "invalid":
+        content = "Je ne peux pas lire ce document."
+    if request_data.get("stream", False):
+        return StreamingResponse(_stream(model, content), media_type="text/event-stream")
+    await asyncio.sleep(_latency())
+    if variant == "error":
+        return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=500)
+    if variant == "no_choices":
+        return {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "model": model, "choices": []}
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(content),
+    }
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": FAKE_LLM_MODEL, "object": "model", "owned_by": "fake"}]}
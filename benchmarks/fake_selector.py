@@ -0,0 +1,26 @@
+"""
+Faux sélecteur de page : renvoie la page contenant « BILAN ACTIF » (ou la première page).
+
+    FAKE_SELECTOR_LATENCY=1 uvicorn fake_selector:app --port 9002
+"""
+import asyncio
+import os
+
+import fitz  # PyMuPDF
+from fastapi import FastAPI, File, UploadFile
+
+FAKE_SELECTOR_LATENCY = float(os.getenv("FAKE_SELECTOR_LATENCY", "1.0"))
+
+app = FastAPI(title="Fake selector", version="1.0.0")
+
+
+@app.post("/select_page")
+async def select_page(pdf_file: UploadFile = File(...)):
+    content = await pdf_file.read()
+    await asyncio.sleep(FAKE_SELECTOR_LATENCY)
+    with fitz.open(stream=content, filetype="pdf") as pdf_document:
+        page_number = next(
+            (page.number for page in pdf_document if "BILAN ACTIF" in page.get_text()),
+            0,
+        )
+    return {"result": "success", "page_number": page_number}
@@ -0,0 +1,75 @@
+"""
+Générateur de charge pour `GET /extract/{siren}?year=` de l'API Centrale.
+
+    python loadgen.py --url http://localhost:8000 --requests 100 --concurrency 8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+from bench_engines import percentile
+
+DEFAULT_SIRENS = ["552032534", "542051180", "775665019", "380129866", "652014051"]
+DEFAULT_YEARS = ["2021", "2022", "2023"]
+
+
+async def run_load(url, n_requests, concurrency, sirens=DEFAULT_SIRENS, years=DEFAULT_YEARS, timeout=900):
+    """Envoie `n_requests` requêtes avec au plus `concurrency` requêtes simultanées."""
+    targets = itertools.cycle(itertools.product(sirens, years))
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def one(client, siren, year):
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                resp = await client.get(f"{url.rstrip('/')}/extract/{siren}", params={"year": year})
+                statuses[str(resp.status_code)] += 1
+                if resp.status_code == 200:
+                    latencies.append(time.perf_counter() - t0)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, *next(targets)) for _ in range(n_requests)))
+        elapsed = time.perf_counter() - t0
+
+    def rounded(value):
+        return round(value, 4) if value is not None else None
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "errors": n_requests - len(latencies),
+        "statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 3),
+        "latency_s": {
+            "mean": rounded(statistics.mean(latencies)) if latencies else None,
+            "p50": rounded(percentile(latencies, 50)),
+            "p95": rounded(percentile(latencies, 95)),
+            "p99": rounded(percentile(latencies, 99)),
+            "max": rounded(max(latencies, default=None)),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de charge pour l'API Centrale")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_load(args.url, args.requests, args.concurrency)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
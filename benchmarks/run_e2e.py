@@ -0,0 +1,199 @@
+"""
+Benchmark de bout en bout : api_centrale → api_marker → marker_proxy, avec des
+services factices pour l'INPI, le sélecteur de page et le LLM.
+
+Lance tous les services en local, injecte la charge, mesure la latence
+(p50/p95/p99), le débit et le pic de mémoire (RSS) de chaque service, puis
+écrit les résultats en JSON (comparables avec compare.py).
+
+    python run_e2e.py --requests 100 --concurrency 8 --marker-engine vlm --output results/run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+import psutil
+
+from loadgen import run_load
+from samples import ensure_samples
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+
+PORTS = {
+    "fake_llm": 9100,
+    "fake_inpi": 9101,
+    "fake_selector": 9102,
+    "marker_proxy": 9103,
+    "api_marker": 9104,
+    "api_centrale": 9105,
+}
+# Services mesurés (RSS) : les trois services du projet
+MEASURED = ("api_centrale", "api_marker", "marker_proxy")
+
+
+def _url(name: str, path: str = "") -> str:
+    return f"http://127.0.0.1:{PORTS[name]}{path}"
+
+
+def service_specs(args) -> dict:
+    """Module uvicorn, répertoire, variables d'environnement et URL de santé de chaque service."""
+    base_env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    return {
+        "fake_llm": ("fake_llm:app", BENCH_DIR, {
+            "FAKE_LLM_LATENCY": str(args.llm_latency),
+            "FAKE_LLM_TOKENS_PER_S": str(args.llm_tokens_per_s),
+        }, "/v1/models"),
+        "fake_inpi": ("fake_inpi:app", BENCH_DIR, {
+            "FAKE_INPI_PDF_DIR": args.samples,
+            "FAKE_INPI_DOWNLOAD_LATENCY": str(args.inpi_latency),
+        }, "/docs"),
+        "fake_selector": ("fake_selector:app", BENCH_DIR, {
+            "FAKE_SELECTOR_LATENCY": str(args.selector_latency),
+        }, "/docs"),
+        "marker_proxy": ("proxy:app", os.path.join(ROOT, "marker_proxy"), {
+            "REAL_LLM_BASE_URL": _url("fake_llm", "/v1/chat/completions"),
+            "REAL_LLM_API_KEY": "fake",
+        }, "/health"),
+        "api_marker": ("main_marker:app", os.path.join(ROOT, "api_marker"), {
+            "PROXY_URL": _url("marker_proxy", "/v1/"),
+            "REAL_LLM_API_KEY": "fake",
+            "EXTRACTION_ENGINE": args.marker_engine,
+            # Moteur VLM seul : pas de chargement des modèles Marker
+            "MARKER_WORKERS": str(args.marker_workers if args.marker_engine == "marker" else 0),
+        }, "/ready"),
+        "api_centrale": ("main_centrale:app", os.path.join(ROOT, "api_centrale"), {
+            "INPI_BASE_URL": _url("fake_inpi", "/api"),
+            "INPI_USERNAME": "bench",
+            "INPI_PASSWORD": "bench",
+            "LEGACY_SELECTOR_URL": _url("fake_selector", "/select_page"),
+            "MARKER_API_URL": _url("api_marker", "/extract"),
+            "AWS_S3_BUCKET": "bench",
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+        }, "/metrics"),
+    }, base_env
+
+
+def start_services(args):
+    specs, base_env = service_specs(args)
+    processes = {}
+    for name, (module, cwd, env, _) in specs.items():
+        log = open(os.path.join(args.log_dir, f"{name}.log"), "w")
+        processes[name] = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(PORTS[name])],
+            cwd=cwd, env={**base_env, **env}, stdout=log, stderr=subprocess.STDOUT,
+        )
+    deadline = time.monotonic() + args.startup_timeout
+    for name, (_, _, _, health) in specs.items():
+        while True:
+            if processes[name].poll() is not None:
+                raise RuntimeError(f"{name} s'est arrêté au démarrage (voir {args.log_dir}/{name}.log)")
+            try:
+                if httpx.get(_url(name, health), timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{name} n'est pas prêt après {args.startup_timeout}s")
+            time.sleep(0.5)
+    return processes
+
+
+class RssSampler(threading.Thread):
+    """Relève périodiquement le RSS (processus + enfants, ex. workers Marker) de chaque service."""
+
+    def __init__(self, processes: dict, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.processes = {name: psutil.Process(p.pid) for name, p in processes.items() if name in MEASURED}
+        self.interval = interval
+        self.peak = {name: 0 for name in self.processes}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for name, process in self.processes.items():
+                try:
+                    tree = [process] + process.children(recursive=True)
+                    rss = sum(p.memory_info().rss for p in tree)
+                except psutil.Error:
+                    continue
+                self.peak[name] = max(self.peak[name], rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout avec services factices")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup-requests", type=int, default=4)
+    parser.add_argument("--marker-engine", choices=["marker", "vlm"], default="vlm")
+    parser.add_argument("--marker-workers", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=100)
+    parser.add_argument("--inpi-latency", type=float, default=0.5)
+    parser.add_argument("--selector-latency", type=float, default=1.0)
+    parser.add_argument("--samples", default=os.path.join(BENCH_DIR, "samples"))
+    parser.add_argument("--startup-timeout", type=float, default=900)
+    parser.add_argument("--log-dir", default=os.path.join(BENCH_DIR, "logs"))
+    parser.add_argument("--label", default="", help="Libellé du run (ex. nom de branche)")
+    parser.add_argument("--output", help="Fichier JSON de résultats")
+    args = parser.parse_args()
+
+    args.samples = os.path.abspath(args.samples)
+    ensure_samples(args.samples)
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    processes = start_services(args)
+    sampler = None
+    try:
+        if args.warmup_requests:
+            asyncio.run(run_load(_url("api_centrale"), args.warmup_requests, args.concurrency))
+        sampler = RssSampler(processes)
+        sampler.start()
+        load = asyncio.run(run_load(_url("api_centrale"), args.requests, args.concurrency))
+        sampler.stop()
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    result = {
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "log_dir", "label")},
+        "load": load,
+        "peak_rss_bytes": sampler.peak if sampler else {},
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
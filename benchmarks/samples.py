@@ -0,0 +1,50 @@
+"""
+Génération de PDF d'exemple (comptes sociaux synthétiques) pour les benchmarks.
+"""
+import os
+import random
+
+import fitz  # PyMuPDF
+
+ROWS = [
+    "Capital souscrit non appelé", "Immobilisations incorporelles", "Immobilisations corporelles",
+    "Immobilisations financières", "Stocks et en-cours", "Créances clients", "Autres créances",
+    "Disponibilités", "Charges constatées d'avance", "Total actif",
+]
+
+
+def make_sample_pdf(path: str, n_pages: int = 8, seed: int = 0):
+    """Écrit un PDF multipage dont une page contient un tableau de bilan."""
+    rng = random.Random(seed)
+    with fitz.open() as pdf_document:
+        table_page = rng.randrange(n_pages)
+        for page_number in range(n_pages):
+            page = pdf_document.new_page()
+            if page_number != table_page:
+                page.insert_text((72, 72), f"Rapport de gestion - page {page_number + 1}", fontsize=14)
+                for i in range(30):
+                    page.insert_text((72, 110 + 20 * i), "Lorem ipsum dolor sit amet, consectetur adipiscing elit.")
+                continue
+            page.insert_text((72, 72), "BILAN ACTIF", fontsize=16)
+            for j, header in enumerate(["Brut", "Amort.", "Net N", "Net N-1"]):
+                page.insert_text((300 + 70 * j, 110), header)
+            for i, label in enumerate(ROWS):
+                y = 135 + 22 * i
+                page.insert_text((72, y), label)
+                for j in range(4):
+                    page.insert_text((300 + 70 * j, y), f"{rng.randint(0, 99999):,}".replace(",", " "))
+        pdf_document.save(path)
+
+
+def ensure_samples(directory: str, n_files: int = 5, n_pages: int = 8) -> list:
+    """Crée `n_files` PDF d'exemple dans `directory` s'il n'en contient pas déjà."""
+    os.makedirs(directory, exist_ok=True)
+    existing = sorted(f for f in os.listdir(directory) if f.endswith(".pdf"))
+    if existing:
+        return [os.path.join(directory, f) for f in existing]
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(directory, f"sample_{i}.pdf")
+        make_sample_pdf(path, n_pages=n_pages, seed=i)
+        paths.append(path)
+    return paths
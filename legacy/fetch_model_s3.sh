@@ -3,14 +3,13 @@
 MODEL_NAME="google/gemma-3-27b-it"
 LOCAL_PATH="/home/onyxia/.cache/huggingface/hub"
 
-MC_PATH=s3/projet-models-hf/diffusion/hf_hub/$MODEL_NAME
+S3_PATH=projet-models-hf/diffusion/hf_hub/$MODEL_NAME
 
-echo "🔹 Checking model availability on SSPCloud..."
-if mc stat "$MC_PATH" >/dev/null 2>&1; then
+echo "🔹 Fetching model from SSPCloud..."
+# Parallel, resumable download: files already present locally are skipped
+if python "$(dirname "$0")/s3_download.py" "$S3_PATH" "$LOCAL_PATH/$MODEL_NAME"; then
     echo "✅ Model is available"
 else
     echo "❌ $MODEL_NAME is not yet available on SSPCloud, it will be fetched it directly from HuggingFace 🤗."
     exit 1
 fi
-
-mc cp -r $MC_PATH/ $LOCAL_PATH/$MODEL_NAME
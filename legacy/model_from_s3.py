@@ -6,6 +6,8 @@ from collections.abc import Iterable
 import s3fs
 from transformers import AutoModelForCausalLM
 
+from s3_download import download_s3_dir
+
 
 logger = logging.getLogger(__name__)
 
@@ -37,41 +39,38 @@ def cache_model_from_hf_hub(
     available_models_s3 = [os.path.basename(path) for path in fs.ls(os.path.join(s3_bucket, s3_cache_dir))]
     dir_model_s3 = os.path.join(s3_bucket, s3_cache_dir, model_name_hf_cache)
 
-    if model_name_hf_cache not in os.listdir(LOCAL_HF_CACHE_DIR):
-        # Try fetching from S3 if available
-        if model_name_hf_cache in available_models_s3:
-            print(f"Fetching model {model_name} from S3.")
-            cmd = ["mc", "cp", "-r", f"s3/{dir_model_s3}", f"{LOCAL_HF_CACHE_DIR}/"]
-            with open("/dev/null", "w") as devnull:
-                subprocess.run(cmd, check=True, stdout=devnull, stderr=devnull)
+    if model_name_hf_cache in available_models_s3:
+        # Fetch from S3: files already in the local cache are skipped, partial files are resumed
+        print(f"Fetching model {model_name} from S3.")
+        stats = download_s3_dir(fs, dir_model_s3, dir_model_local)
+        print(f"Model {model_name} fetched from S3: {stats}")
+    elif model_name_hf_cache not in os.listdir(LOCAL_HF_CACHE_DIR):
         # Else, fetch from HF Hub and push to S3
-        else:
-            print(f"Model {model_name} not found on S3, fetching from HF hub.")
-            AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", token=hf_token)
-            print(f"Putting model {model_name} on S3.")
-            cmd = [
-                "mc",
-                "cp",
-                "-r",
-                f"{dir_model_local}/",
-                f"s3/{dir_model_s3}",
-            ]
-            with open("/dev/null", "w") as devnull:
-                subprocess.run(cmd, check=True, stdout=devnull, stderr=devnull)
+        print(f"Model {model_name} not found on S3, fetching from HF hub.")
+        AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", token=hf_token)
+        print(f"Putting model {model_name} on S3.")
+        cmd = [
+            "mc",
+            "cp",
+            "-r",
+            f"{dir_model_local}/",
+            f"s3/{dir_model_s3}",
+        ]
+        with open("/dev/null", "w") as devnull:
+            subprocess.run(cmd, check=True, stdout=devnull, stderr=devnull)
     else:
         print(f"Model {model_name} found in local cache. ")
-        if model_name_hf_cache not in available_models_s3:
-            # Push from local HF cache to S3
-            print(f"Putting model {model_name} on S3.")
-            cmd = [
-                "mc",
-                "cp",
-                "-r",
-                f"{dir_model_local}/",
-                f"s3/{dir_model_s3}",
-            ]
-            with open("/dev/null", "w") as devnull:
-                subprocess.run(cmd, check=True, stdout=devnull, stderr=devnull)
+        # Push from local HF cache to S3
+        print(f"Putting model {model_name} on S3.")
+        cmd = [
+            "mc",
+            "cp",
+            "-r",
+            f"{dir_model_local}/",
+            f"s3/{dir_model_s3}",
+        ]
+        with open("/dev/null", "w") as devnull:
+            subprocess.run(cmd, check=True, stdout=devnull, stderr=devnull)
 
 
 def cache_models_from_hf_hub(
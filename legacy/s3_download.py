@@ -0,0 +1,301 @@
+"""
+Parallel, resumable download of an S3 directory (model weights, HF cache).
+
+Identical copy in api_marker/ (the init container of the api-marker pod fills
+its model cache with it, and each service is built in its own Docker context):
+keep both copies in sync.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import s3fs
+
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * MiB
+DEFAULT_MAX_WORKERS = 16
+MAX_ATTEMPTS = 4
+# Part sizes commonly used by S3 clients (mc, s3fs, boto3, aws cli) for multipart uploads
+COMMON_PART_SIZES = [5 * MiB, 8 * MiB, 15 * MiB, 16 * MiB, 50 * MiB, 64 * MiB, 128 * MiB]
+INCOMPLETE_SUFFIX = ".incomplete"
+
+
+def _etag(info: dict) -> str | None:
+    etag = info.get("ETag") or info.get("etag")
+    return etag.strip('"') if etag else None
+
+
+def _multipart_etag(path: str, part_size: int) -> str:
+    digests = []
+    with open(path, "rb") as f:
+        while block := f.read(part_size):
+            digests.append(hashlib.md5(block).digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+# HeadObject response fields set on objects stored with server-side encryption
+_SSE_KEYS = ("ServerSideEncryption", "SSEKMSKeyId", "SSECustomerAlgorithm")
+
+
+def is_encrypted(fs: s3fs.S3FileSystem, s3_path: str) -> bool:
+    """Tell whether an object is stored with server-side encryption.
+
+    Listings (``fs.find``/``fs.ls``) and ``fs.info`` do not report SSE, so this
+    issues a HEAD request on the object.
+    """
+    bucket, key, _ = fs.split_path(s3_path)
+    head = fs.call_s3("head_object", Bucket=bucket, Key=key)
+    return any(head.get(field) for field in _SSE_KEYS)
+
+
+def verify_etag(path: str, size: int, etag: str | None, encrypted: bool = False) -> bool | None:
+    """Check a downloaded file against its S3 ETag.
+
+    Returns:
+        bool | None: True if the ETag matches, False if it does not (for a
+        multipart ETag, only when its part size is unambiguous), None if it
+        cannot be verified. ETags of SSE-S3/KMS objects (e.g. on MinIO) are not
+        MD5 digests, so encrypted objects are never checked.
+    """
+    if not etag or encrypted:
+        return None
+    if "-" not in etag:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "md5").hexdigest() == etag
+    n_parts = int(etag.rsplit("-", 1)[1])
+    # Clients upload with whole-MiB part sizes: list those giving exactly n_parts parts
+    mib_sizes = [p * MiB for p in range(1, math.ceil(size / MiB) + 1) if math.ceil(size / (p * MiB)) == n_parts]
+    candidates = {math.ceil(size / n_parts / MiB) * MiB}
+    candidates.update(p for p in COMMON_PART_SIZES if math.ceil(size / p) == n_parts)
+    if len(mib_sizes) == 1:
+        candidates.update(mib_sizes)
+    for part_size in sorted(candidates):
+        if _multipart_etag(path, part_size) == etag:
+            return True
+    return False if len(mib_sizes) == 1 else None
+
+
+class _Progress:
+    """Thread-safe byte counter used to report throughput."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+        self._last_report = self.start
+
+    def add(self, n: int):
+        with self._lock:
+            self.done += n
+            now = time.monotonic()
+            if now - self._last_report >= 5:
+                self._last_report = now
+                logger.info(
+                    "%.1f / %.1f MiB (%.1f MiB/s)",
+                    self.done / MiB, self.total / MiB, self.rate() / MiB,
+                )
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+
+class _PartialFile:
+    """A file being downloaded by range chunks, with a manifest of completed chunks for resume."""
+
+    def __init__(self, local_path: str, size: int, etag: str | None, chunk_size: int,
+                 encrypted: bool = False):
+        self.local_path = local_path
+        self.tmp_path = local_path + INCOMPLETE_SUFFIX
+        self.manifest_path = self.tmp_path + ".json"
+        self.size = size
+        self.etag = etag
+        self.encrypted = encrypted
+        self.chunk_size = chunk_size
+        self.n_chunks = max(1, math.ceil(size / chunk_size))
+        self.done: set[int] = set()
+        self._lock = threading.Lock()
+        self._load()
+        if size == 0:
+            self.done = {0}
+        self.fd = os.open(self.tmp_path, os.O_RDWR | os.O_CREAT)
+        os.ftruncate(self.fd, size)
+
+    def _load(self):
+        if not (os.path.exists(self.tmp_path) and os.path.exists(self.manifest_path)):
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        # Only resume if the remote object and the chunking are unchanged
+        if manifest.get("etag") == self.etag and manifest.get("chunk_size") == self.chunk_size:
+            self.done = set(manifest.get("done", []))
+
+    def pending(self) -> list[int]:
+        return [i for i in range(self.n_chunks) if i not in self.done]
+
+    def pending_bytes(self) -> int:
+        return sum(min(self.chunk_size, self.size - i * self.chunk_size) for i in self.pending())
+
+    def write_chunk(self, index: int, data: bytes):
+        os.pwrite(self.fd, data, index * self.chunk_size)
+        with self._lock:
+            self.done.add(index)
+            with open(self.manifest_path, "w") as f:
+                json.dump({"etag": self.etag, "chunk_size": self.chunk_size, "done": sorted(self.done)}, f)
+
+    def finalize(self):
+        os.fsync(self.fd)
+        self.close()
+        actual = os.path.getsize(self.tmp_path)
+        if actual != self.size:
+            raise IOError(f"Size mismatch for {self.local_path}: expected {self.size}, got {actual}")
+        verified = verify_etag(self.tmp_path, self.size, self.etag, self.encrypted)
+        if verified is False:
+            self.discard()
+            raise IOError(f"ETag mismatch for {self.local_path}")
+        if verified is None:
+            logger.warning("Could not verify ETag of %s, size check only.", self.local_path)
+        os.replace(self.tmp_path, self.local_path)
+        os.remove(self.manifest_path)
+
+    def close(self):
+        # The fd number may be reused once closed: never close it twice
+        if self.fd is None:
+            return
+        fd, self.fd = self.fd, None
+        os.close(fd)
+
+    def discard(self):
+        for path in (self.tmp_path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _fetch_chunk(fs: s3fs.S3FileSystem, s3_path: str, partial: _PartialFile, index: int, progress: _Progress):
+    start = index * partial.chunk_size
+    end = min(start + partial.chunk_size, partial.size)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            data = fs.cat_file(s3_path, start=start, end=end)
+            if len(data) != end - start:
+                raise IOError(f"Short read on {s3_path} [{start}:{end}]: {len(data)} bytes")
+            partial.write_chunk(index, data)
+            progress.add(len(data))
+            return
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            delay = min(2**attempt, 30) * random.uniform(0.5, 1.5)
+            logger.warning("Chunk %s of %s failed (%s), retrying in %.1fs", index, s3_path, e, delay)
+            time.sleep(delay)
+
+
+def download_s3_dir(
+    fs: s3fs.S3FileSystem,
+    s3_dir: str,
+    local_dir: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> dict:
+    """Download an S3 directory in parallel with range GETs, resuming partial files.
+
+    Files already present locally with the expected size are skipped, so an
+    existing HF cache directory is only completed, not downloaded again.
+
+    Args:
+        fs (s3fs.S3FileSystem): S3 filesystem.
+        s3_dir (str): Source directory on S3 (bucket/prefix).
+        local_dir (str): Local destination directory.
+        max_workers (int): Number of concurrent range requests.
+        chunk_size (int): Size of each range request in bytes.
+
+    Returns:
+        dict: Download statistics (files, skipped, bytes, seconds, MiB/s).
+    """
+    s3_dir = s3_dir.rstrip("/")
+    remote = {p: info for p, info in fs.find(s3_dir, detail=True).items() if info.get("type") != "directory"}
+    if not remote:
+        raise FileNotFoundError(f"Nothing to download at s3://{s3_dir}")
+
+    partials: list[tuple[str, _PartialFile]] = []
+    skipped = 0
+    for s3_path, info in remote.items():
+        local_path = os.path.join(local_dir, os.path.relpath(s3_path, s3_dir))
+        size = int(info["size"])
+        if os.path.isfile(local_path) and os.path.getsize(local_path) == size:
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        etag = _etag(info)
+        encrypted = bool(etag) and is_encrypted(fs, s3_path)
+        partials.append((s3_path, _PartialFile(local_path, size, etag, chunk_size, encrypted)))
+
+    progress = _Progress(sum(p.pending_bytes() for _, p in partials))
+    logger.info(
+        "Downloading %s files (%.1f MiB) from s3://%s, %s already cached locally.",
+        len(partials), progress.total / MiB, s3_dir, skipped,
+    )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_fetch_chunk, fs, s3_path, partial, index, progress)
+                for s3_path, partial in partials
+                for index in partial.pending()
+            ]
+            for future in as_completed(futures):
+                future.result()
+        for _, partial in partials:
+            partial.finalize()
+    except BaseException:
+        # Keep .incomplete files and manifests so that the next run resumes
+        for _, partial in partials:
+            partial.close()
+        raise
+
+    elapsed = time.monotonic() - progress.start
+    stats = {
+        "files": len(partials),
+        "skipped": skipped,
+        "bytes": progress.done,
+        "seconds": round(elapsed, 2),
+        "mib_per_s": round(progress.rate() / MiB, 2),
+    }
+    logger.info("Download of s3://%s done: %s", s3_dir, stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel, resumable download of an S3 directory.")
+    parser.add_argument("s3_dir", help="Source directory on S3 (bucket/prefix).")
+    parser.add_argument("local_dir", help="Local destination directory.")
+    parser.add_argument("--endpoint-url", default=os.getenv("AWS_S3_ENDPOINT", "minio.lab.sspcloud.fr"))
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--chunk-size-mib", type=int, default=DEFAULT_CHUNK_SIZE // MiB)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    endpoint = args.endpoint_url
+    if not endpoint.startswith(("http://", "https://")):
+        endpoint = f"https://{endpoint}"
+    fs = s3fs.S3FileSystem(endpoint_url=endpoint)
+    if not fs.exists(args.s3_dir):
+        logger.error("s3://%s does not exist.", args.s3_dir)
+        sys.exit(1)
+    download_s3_dir(fs, args.s3_dir, args.local_dir, args.max_workers, args.chunk_size_mib * MiB)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import base64
+import binascii
+import io
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image
+from prometheus_client import Counter, Histogram
+
+from observability import SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Réduction des images envoyées au LLM (désactivée par défaut)
+PROXY_IMAGE_TRANSFORM = os.getenv("PROXY_IMAGE_TRANSFORM", "0") == "1"
+PROXY_IMAGE_MAX_PIXELS = int(os.getenv("PROXY_IMAGE_MAX_PIXELS", "1500000"))
+PROXY_IMAGE_FORMAT = os.getenv("PROXY_IMAGE_FORMAT", "jpeg").lower()
+PROXY_IMAGE_QUALITY = int(os.getenv("PROXY_IMAGE_QUALITY", "85"))
+# Réglages par modèle, ex. {"gemma3:27b": {"max_pixels": 1000000, "format": "webp", "quality": 80}}
+PROXY_IMAGE_MODEL_OVERRIDES: Dict[str, Dict[str, Any]] = json.loads(
+    os.getenv("PROXY_IMAGE_MODEL_OVERRIDES", "{}")
+)
+
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+IMAGE_BYTES = Histogram(
+    "proxy_image_bytes",
+    "Taille des images envoyées au LLM, avant et après transformation",
+    ["model", "stage"],
+    buckets=SIZE_BUCKETS,
+)
+IMAGE_BYTES_SAVED = Counter(
+    "proxy_image_bytes_saved_total",
+    "Octets d'image économisés par la transformation",
+    ["model"],
+)
+
+
+def settings_for(model: str) -> Dict[str, Any]:
+    """Réglages de transformation pour un modèle (valeurs globales + surcharges du modèle)."""
+    settings = {
+        "enabled": PROXY_IMAGE_TRANSFORM,
+        "max_pixels": PROXY_IMAGE_MAX_PIXELS,
+        "format": PROXY_IMAGE_FORMAT,
+        "quality": PROXY_IMAGE_QUALITY,
+    }
+    settings.update(PROXY_IMAGE_MODEL_OVERRIDES.get(model, {}))
+    return settings
+
+
+def transform_image(data: bytes, max_pixels: int, fmt: str, quality: int) -> Tuple[bytes, str]:
+    """
+    Réduit une image à au plus `max_pixels` pixels et la réencode en JPEG ou WebP.
+
+    Returns:
+        tuple: (octets de l'image, type MIME)
+    """
+    pil_format, mime = _FORMATS[fmt]
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        width, height = img.size
+        if width * height > max_pixels:
+            scale = math.sqrt(max_pixels / (width * height))
+            img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, pil_format, quality=quality)
+    return out.getvalue(), mime
+
+
+def transform_messages(messages: List[Dict[str, Any]], model: str) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Applique la transformation aux images `image_url` encodées en data URL dans les messages.
+
+    L'image d'origine est conservée si la version transformée n'est pas plus petite.
+
+    Returns:
+        tuple: (messages transformés, statistiques images/octets avant/après)
+    """
+    settings = settings_for(model)
+    stats = {"images": 0, "bytes_before": 0, "bytes_after": 0}
+    if not settings["enabled"]:
+        return messages, stats
+
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "image_url":
+                continue
+            image_url = part.get("image_url") or {}
+            url = image_url.get("url", "")
+            if not url.startswith("data:image/") or ";base64," not in url:
+                continue
+            try:
+                original = base64.b64decode(url.split(";base64,", 1)[1])
+                transformed, mime = transform_image(
+                    original, settings["max_pixels"], settings["format"], settings["quality"]
+                )
+            except (binascii.Error, OSError, ValueError) as e:
+                logger.warning("Image non transformée : %s", e)
+                continue
+            if len(transformed) >= len(original):
+                transformed = original
+            else:
+                image_url["url"] = f"data:{mime};base64,{base64.b64encode(transformed).decode('utf-8')}"
+            stats["images"] += 1
+            stats["bytes_before"] += len(original)
+            stats["bytes_after"] += len(transformed)
+            IMAGE_BYTES.labels(model, "before").observe(len(original))
+            IMAGE_BYTES.labels(model, "after").observe(len(transformed))
+            IMAGE_BYTES_SAVED.labels(model).inc(len(original) - len(transformed))
+    return messages, stats
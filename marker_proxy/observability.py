@@ -0,0 +1,139 @@
+"""
+Métriques Prometheus et propagation du contexte de trace (W3C traceparent).
+
+Module identique dans api_centrale, api_marker et marker_proxy (chaque service
+est construit dans son propre contexte Docker) : toute modification doit être
+reportée dans les trois copies.
+"""
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+TRACEPARENT_HEADER = "traceparent"
+REQUEST_ID_HEADER = "x-request-id"
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# Contexte de la requête en cours : trace_id, span_id, request_id
+_trace_context: ContextVar[Dict[str, str]] = ContextVar("trace_context", default={})
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = tuple(2 ** i for i in range(10, 29, 2))  # 1 Kio → 256 Mio
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Durée des requêtes HTTP reçues",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requêtes HTTP en cours de traitement",
+)
+STAGE_DURATION = Histogram(
+    "extraction_stage_duration_seconds",
+    "Durée de chaque étape du traitement",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGES_IN_FLIGHT = Gauge(
+    "extraction_stages_in_flight",
+    "Étapes de traitement en cours",
+    ["stage"],
+)
+PAYLOAD_SIZE = Histogram(
+    "payload_size_bytes",
+    "Taille des documents et charges utiles échangés",
+    ["kind"],
+    buckets=SIZE_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "extraction_stage_errors_total",
+    "Erreurs par étape du traitement",
+    ["stage"],
+)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict[str, str]]:
+    """Décode un en-tête traceparent W3C ; renvoie None s'il est absent ou invalide."""
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return {"trace_id": match.group(1), "parent_id": match.group(2), "flags": match.group(3)}
+
+
+def current_trace() -> Dict[str, str]:
+    """Contexte de trace de la requête en cours (vide hors requête)."""
+    return _trace_context.get()
+
+
+def trace_headers() -> Dict[str, str]:
+    """En-têtes à transmettre aux appels sortants pour rattacher le sous-appel à la trace en cours."""
+    context = _trace_context.get()
+    if not context:
+        return {}
+    return {
+        TRACEPARENT_HEADER: f"00-{context['trace_id']}-{context['span_id']}-01",
+        REQUEST_ID_HEADER: context["request_id"],
+    }
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Mesure la durée d'une étape (histogramme, jauge d'étapes en cours, compteur d'erreurs)."""
+    STAGES_IN_FLIGHT.labels(stage).inc()
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - t0)
+        STAGES_IN_FLIGHT.labels(stage).dec()
+
+
+def setup_observability(app: FastAPI):
+    """Ajoute le middleware de trace/métriques HTTP et l'endpoint `/metrics` à l'application."""
+
+    @app.middleware("http")
+    async def trace_middleware(request: Request, call_next):
+        parent = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        trace_id = parent["trace_id"] if parent else secrets.token_hex(16)
+        span_id = _new_span_id()
+        request_id = request.headers.get(REQUEST_ID_HEADER) or trace_id
+        token = _trace_context.set({"trace_id": trace_id, "span_id": span_id, "request_id": request_id})
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            # Route modèle (ex. /extract/{siren}) pour limiter la cardinalité des labels
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            HTTP_REQUEST_DURATION.labels(request.method, route, str(status)).observe(time.perf_counter() - t0)
+            _trace_context.reset(token)
+        response.headers[TRACEPARENT_HEADER] = f"00-{trace_id}-{span_id}-01"
+        response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    # Hors du pool de threads des endpoints synchrones, que des appels longs peuvent saturer
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -7,7 +7,22 @@ from dotenv import load_dotenv
 from typing import Any, Dict, Optional
 from datetime import datetime
 import logging
+import time
+import asyncio
 from langfuse import get_client
+from prometheus_client import Counter, Histogram
+from image_transform import transform_messages
+from rate_limit import TokenRateLimiter, estimate_prompt_tokens, identify_client
+from observability import (
+    LATENCY_BUCKETS,
+    PAYLOAD_SIZE,
+    STAGE_DURATION,
+    current_trace,
+    setup_observability,
+    stage_timer,
+    trace_headers,
+)
+from profiler import setup_profiler
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -29,7 +44,58 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc"
 )
+setup_observability(app)
+setup_profiler(app)
 langfuse = get_client()
+rate_limiter = TokenRateLimiter()
+
+# Métriques propres au proxy
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Délai avant le premier fragment d'une réponse en streaming",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens consommés d'après l'usage renvoyé par le LLM",
+    ["model", "kind"],
+)
+
+
+async def reserve_tokens(request: Request, request_data: Dict):
+    """Vérifie le budget du client avant transmission ; renvoie (client, tokens réservés)."""
+    client_id = identify_client(request)
+    reserved = estimate_prompt_tokens(request_data)
+    decision = await rate_limiter.acquire(client_id, reserved)
+    if not decision.allowed:
+        logger.warning("Budget épuisé pour %s (solde %.0f tokens)", client_id, decision.balance)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Budget de tokens épuisé pour le client {client_id}",
+            headers={"Retry-After": str(int(decision.retry_after))},
+        )
+    return client_id, reserved
+
+
+def total_tokens(usage: Optional[Dict]) -> Optional[int]:
+    """Nombre total de tokens d'après l'usage renvoyé par le LLM (None si inconnu)."""
+    if not usage:
+        return None
+    if usage.get("total_tokens") is not None:
+        return usage["total_tokens"]
+    if usage.get("input_tokens") is None and usage.get("output_tokens") is None:
+        return None
+    return (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+
+
+def record_usage(model: str, usage: Optional[Dict]):
+    """Comptabilise les tokens d'entrée/sortie renvoyés par le LLM."""
+    if not usage:
+        return
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.labels(model, kind).inc(usage[kind])
 
 
 def extract_usage_from_response(response_data: Dict) -> Optional[Dict]:
@@ -62,7 +128,14 @@ async def chat_completions(request: Request):
     """Proxy pour les chat-completions (streaming supporté)."""
     request_data = await request.json()
     model = request_data.get("model", "unknown")
-    messages = request_data.get("messages", [])
+    client_id, reserved = await reserve_tokens(request, request_data)
+    # Réduction/recompression optionnelle des images (avant envoi au LLM et traçage Langfuse)
+    messages, image_stats = await asyncio.to_thread(
+        transform_messages, request_data.get("messages", []), model
+    )
+    request_data["messages"] = messages
+    if image_stats["images"]:
+        logger.info("Images transformées : %s", image_stats)
 
     headers = {
         "Authorization": f"Bearer {REAL_LLM_API_KEY}",
@@ -72,6 +145,9 @@ async def chat_completions(request: Request):
     for key, value in request.headers.items():
         if key.lower() not in ["authorization", "host", "content-length"]:
             headers[key] = value
+    # Le LLM est rattaché à la trace de la requête (span du proxy comme parent)
+    headers.update(trace_headers())
+    PAYLOAD_SIZE.labels("llm_request").observe(len(await request.body()))
 
     real_url = REAL_LLM_BASE_URL
 
@@ -83,6 +159,9 @@ async def chat_completions(request: Request):
         root_span.update_trace(metadata={
             "proxy_version": "1.0.0",
             "timestamp": datetime.utcnow().isoformat(),
+            "trace_id": current_trace().get("trace_id"),
+            "request_id": current_trace().get("request_id"),
+            "image_transform": image_stats,
         })
 
         async with httpx.AsyncClient(timeout=300.0) as client:
@@ -91,6 +170,9 @@ async def chat_completions(request: Request):
                 async def stream_proxy():
                     full_response = ""
                     usage_info = None
+                    t0 = time.perf_counter()
+                    first_chunk = True
+                    response_bytes = 0
 
                     # Génération Langfuse contextuelle
                     with langfuse.start_as_current_generation(
@@ -112,6 +194,7 @@ async def chat_completions(request: Request):
                             if response.status_code != 200:
                                 text = await response.aread()
                                 logger.error(f"LLM error {response.status_code}: {text}")
+                                await rate_limiter.settle(client_id, reserved, 0)
                                 raise HTTPException(
                                     status_code=response.status_code,
                                     detail=text.decode(),
@@ -122,6 +205,10 @@ async def chat_completions(request: Request):
                                     continue
                                 # OpenAI-style "data: " prefix
                                 data_str = line.removeprefix("data: ").strip()
+                                response_bytes += len(line)
+                                if first_chunk:
+                                    LLM_TIME_TO_FIRST_TOKEN.labels(model).observe(time.perf_counter() - t0)
+                                    first_chunk = False
                                 if data_str == "[DONE]":
                                     yield "data: [DONE]\n\n"
                                     break
@@ -144,6 +231,14 @@ async def chat_completions(request: Request):
 
                         # À la fin du streaming, terminer la génération
                         gen.update(output=full_response, usage=usage_info)
+                        STAGE_DURATION.labels("llm_upstream_stream").observe(time.perf_counter() - t0)
+                        PAYLOAD_SIZE.labels("llm_response").observe(response_bytes)
+                        record_usage(model, usage_info)
+                        # Sans usage dans le flux, estimation de la sortie (4 caractères par token)
+                        used = total_tokens(usage_info)
+                        if used is None:
+                            used = reserved + len(full_response) // 4
+                        await rate_limiter.settle(client_id, reserved, used)
 
                 return StreamingResponse(
                     stream_proxy(),
@@ -156,14 +251,19 @@ async def chat_completions(request: Request):
 
             else:
                 # Non-streaming : simple POST
-                response = await client.post(real_url, headers=headers, json=request_data)
+                with stage_timer("llm_upstream"):
+                    response = await client.post(real_url, headers=headers, json=request_data)
                 if response.status_code != 200:
                     logger.error(f"LLM error {response.status_code}: {response.text}")
+                    await rate_limiter.settle(client_id, reserved, 0)
                     raise HTTPException(response.status_code, response.text)
 
+                PAYLOAD_SIZE.labels("llm_response").observe(len(response.content))
                 data = response.json()
                 content = extract_content_from_response(data)
                 usage = extract_usage_from_response(data)
+                record_usage(model, usage)
+                await rate_limiter.settle(client_id, reserved, total_tokens(usage))
 
                 # Tracer la génération LLM
                 with langfuse.start_as_current_generation(
@@ -187,6 +287,7 @@ async def completions(request: Request):
     request_data = await request.json()
     prompt = request_data.get("prompt", "")
     model = request_data.get("model", "unknown")
+    client_id, reserved = await reserve_tokens(request, request_data)
 
     headers = {
         "Authorization": f"Bearer {REAL_LLM_API_KEY}",
@@ -195,6 +296,8 @@ async def completions(request: Request):
     for key, value in request.headers.items():
         if key.lower() not in ["authorization", "host", "content-length"]:
             headers[key] = value
+    headers.update(trace_headers())
+    PAYLOAD_SIZE.labels("llm_request").observe(len(await request.body()))
 
     real_url = f"{REAL_LLM_BASE_URL.rstrip('/')}/v1/completions"
 
@@ -205,17 +308,24 @@ async def completions(request: Request):
         root_span.update_trace(metadata={
             "proxy_version": "1.0.0",
             "timestamp": datetime.utcnow().isoformat(),
+            "trace_id": current_trace().get("trace_id"),
+            "request_id": current_trace().get("request_id"),
         })
 
         async with httpx.AsyncClient(timeout=300.0) as client:
-            resp = await client.post(real_url, headers=headers, json=request_data)
+            with stage_timer("llm_upstream"):
+                resp = await client.post(real_url, headers=headers, json=request_data)
             if resp.status_code != 200:
                 logger.error(f"LLM error {resp.status_code}: {resp.text}")
+                await rate_limiter.settle(client_id, reserved, 0)
                 raise HTTPException(resp.status_code, resp.text)
 
+            PAYLOAD_SIZE.labels("llm_response").observe(len(resp.content))
             data = resp.json()
             text = data.get("choices", [{}])[0].get("text", "")
             usage = extract_usage_from_response(data)
+            record_usage(model, usage)
+            await rate_limiter.settle(client_id, reserved, total_tokens(usage))
 
             with langfuse.start_as_current_generation(
                 name="completion",
@@ -249,6 +359,7 @@ async def health_check():
         "status": "ok",
         "langfuse_configured": True,
         "real_llm_configured": bool(REAL_LLM_API_KEY),
+        "rate_limit_enabled": rate_limiter.enabled,
     }
 
 
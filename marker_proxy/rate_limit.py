@@ -0,0 +1,188 @@
+"""
+Limitation de débit par client (seaux de tokens), d'après l'usage renvoyé par le LLM.
+
+Chaque client dispose d'un budget en tokens par minute. Une requête n'est
+transmise que si le seau du client est positif ; une estimation des tokens
+du prompt est alors réservée, puis corrigée avec l'usage réel (`usage`) à la
+fin de la réponse. Le solde peut devenir négatif : le client attend alors que
+son seau se remplisse à nouveau.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "0") == "1"
+RATE_LIMIT_DEFAULT_TPM = float(os.getenv("RATE_LIMIT_DEFAULT_TPM", "100000"))
+# Budgets par client, ex. {"api-centrale": 200000, "prefetch": 20000} ; seuls ces identifiants sont reconnus
+RATE_LIMIT_CLIENT_TPM: Dict[str, float] = json.loads(os.getenv("RATE_LIMIT_CLIENT_TPM", "{}"))
+# Capacité du seau, en minutes de budget (rafale autorisée)
+RATE_LIMIT_BURST_MINUTES = float(os.getenv("RATE_LIMIT_BURST_MINUTES", "1"))
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "x-client-id")
+# Backend partagé entre répliques du proxy (Redis ou compatible) ; mémoire locale sinon
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# Estimation forfaitaire des tokens d'une image, avant connaissance de l'usage réel
+RATE_LIMIT_IMAGE_TOKENS = int(os.getenv("RATE_LIMIT_IMAGE_TOKENS", "800"))
+
+# Seau partagé par toutes les requêtes sans identifiant de client reconnu (budget RATE_LIMIT_DEFAULT_TPM)
+DEFAULT_CLIENT = "default"
+
+RATE_LIMIT_REJECTIONS = Counter("rate_limit_rejections_total", "Requêtes refusées (budget épuisé)", ["client"])
+RATE_LIMIT_TOKENS = Counter("rate_limit_tokens_total", "Tokens décomptés des budgets clients", ["client"])
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    balance: float
+    retry_after: float
+
+
+def identify_client(request: Request) -> str:
+    """
+    Identifie le client par l'en-tête dédié, s'il a un budget dans RATE_LIMIT_CLIENT_TPM.
+
+    Toute autre requête est rattachée au client par défaut : changer d'identifiant
+    (ou de clé d'API, non vérifiée par le proxy) ne donne pas de nouveau budget, et
+    le nombre de seaux et de séries Prometheus reste borné.
+    """
+    client_id = request.headers.get(RATE_LIMIT_CLIENT_HEADER)
+    if client_id and client_id in RATE_LIMIT_CLIENT_TPM:
+        return client_id
+    return DEFAULT_CLIENT
+
+
+def estimate_prompt_tokens(request_data: Dict[str, Any]) -> int:
+    """Estimation grossière (4 caractères par token, forfait par image) des tokens du prompt."""
+    chars, images = len(request_data.get("prompt") or ""), 0
+    for message in request_data.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get("type") == "text":
+                    chars += len(part.get("text") or "")
+                elif part.get("type") == "image_url":
+                    images += 1
+    return chars // 4 + images * RATE_LIMIT_IMAGE_TOKENS
+
+
+class MemoryBucketStore:
+    """Seaux en mémoire (un seul processus proxy)."""
+
+    def __init__(self):
+        self._buckets: Dict[str, tuple] = {}
+        self._lock = asyncio.Lock()
+
+    async def consume(self, key: str, amount: float, rate: float, capacity: float, require_positive: bool):
+        async with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if require_positive and tokens <= 0:
+                self._buckets[key] = (tokens, now)
+                return False, tokens
+            tokens -= amount
+            self._buckets[key] = (tokens, now)
+            return True, tokens
+
+
+# Remplissage + consommation atomiques côté serveur (horloge Redis commune aux répliques)
+_REDIS_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local amount = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local require_positive = ARGV[4] == '1'
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local allowed = 1
+if require_positive and tokens <= 0 then
+  allowed = 0
+else
+  tokens = tokens - amount
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore:
+    """Seaux partagés dans Redis (ou serveur compatible), pour plusieurs répliques du proxy."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # dépendance utilisée uniquement avec RATE_LIMIT_REDIS_URL
+
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+
+    async def consume(self, key: str, amount: float, rate: float, capacity: float, require_positive: bool):
+        allowed, tokens = await self._script(
+            keys=[f"marker_proxy:bucket:{key}"],
+            args=[amount, rate, capacity, "1" if require_positive else "0"],
+        )
+        return bool(int(allowed)), float(tokens)
+
+
+class TokenRateLimiter:
+    """Budgets en tokens par minute, par client."""
+
+    def __init__(self, store=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        if store is None:
+            store = RedisBucketStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBucketStore()
+        self.store = store
+
+    @staticmethod
+    def _limits(client: str):
+        tpm = float(RATE_LIMIT_CLIENT_TPM.get(client, RATE_LIMIT_DEFAULT_TPM))
+        return tpm / 60, tpm * RATE_LIMIT_BURST_MINUTES
+
+    async def acquire(self, client: str, estimate: int) -> Decision:
+        """Réserve `estimate` tokens si le seau du client est positif.
+
+        Si le backend des seaux est indisponible, la requête est acceptée (comme dans `settle`).
+        """
+        if not self.enabled:
+            return Decision(True, float("inf"), 0.0)
+        rate, capacity = self._limits(client)
+        try:
+            allowed, balance = await self.store.consume(client, estimate, rate, capacity, True)
+        except Exception as e:
+            logger.error("Budget de %s non vérifié (backend indisponible) : %s", client, e)
+            return Decision(True, float("inf"), 0.0)
+        if not allowed:
+            RATE_LIMIT_REJECTIONS.labels(client).inc()
+            # Temps nécessaire pour que le solde redevienne positif
+            return Decision(False, balance, (-balance / rate) + 1 if rate else 60.0)
+        return Decision(True, balance, 0.0)
+
+    async def settle(self, client: str, reserved: int, actual: Optional[int]):
+        """Corrige la réservation avec l'usage réel (`actual=0` rembourse un appel échoué).
+
+        Sans usage renvoyé par le LLM (`actual=None`), la réservation est conservée.
+        """
+        if not self.enabled:
+            return
+        used = actual if actual is not None else reserved
+        rate, capacity = self._limits(client)
+        try:
+            await self.store.consume(client, used - reserved, rate, capacity, False)
+        except Exception as e:
+            logger.error("Mise à jour du budget de %s impossible : %s", client, e)
+        RATE_LIMIT_TOKENS.labels(client).inc(used)
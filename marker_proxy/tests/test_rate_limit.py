@@ -0,0 +1,66 @@
+"""
+Tests de l'identification des clients et des budgets de tokens du proxy.
+
+    pip install pytest fastapi prometheus_client
+    python -m pytest marker_proxy/tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from starlette.requests import Request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "marker_proxy"))
+
+import rate_limit  # noqa: E402
+from rate_limit import DEFAULT_CLIENT, MemoryBucketStore, TokenRateLimiter, identify_client  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def client_budgets(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_CLIENT_TPM", {"api-centrale": 6000, "prefetch": 600})
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_DEFAULT_TPM", 600)
+
+
+def request(headers):
+    raw = [(name.encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "POST", "path": "/v1/chat/completions", "headers": raw})
+
+
+@pytest.mark.parametrize("headers, client", [
+    ({"x-client-id": "prefetch"}, "prefetch"),
+    ({"x-client-id": "inconnu-42"}, DEFAULT_CLIENT),
+    ({"authorization": "Bearer sk-123"}, DEFAULT_CLIENT),
+    ({}, DEFAULT_CLIENT),
+])
+def test_identify_client_only_accepts_listed_ids(headers, client):
+    assert identify_client(request(headers)) == client
+
+
+def test_unknown_ids_share_the_default_bucket():
+    limiter = TokenRateLimiter(MemoryBucketStore(), enabled=True)
+
+    async def scenario():
+        decisions = []
+        for i in range(3):
+            client = identify_client(request({"x-client-id": f"bulk-{i}"}))
+            decisions.append(await limiter.acquire(client, 400))
+        return decisions
+
+    first, second, third = asyncio.run(scenario())
+    assert first.allowed and second.allowed
+    assert not third.allowed and third.retry_after > 0
+
+
+class BrokenStore:
+    async def consume(self, *args):
+        raise ConnectionError("redis down")
+
+
+def test_backend_errors_fail_open():
+    limiter = TokenRateLimiter(BrokenStore(), enabled=True)
+    decision = asyncio.run(limiter.acquire("prefetch", 100))
+    assert decision.allowed
+    asyncio.run(limiter.settle("prefetch", 100, 80))